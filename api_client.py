@@ -0,0 +1,317 @@
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cache import TTLCache
+from metrics import observe_request
+
+# Overridable to point the app at a stand-in server, e.g. benchmarks/fake_api.py
+CLICKUP_API_URL = os.environ.get('CLICKUP_API_URL', 'https://api.clickup.com/api/v2')
+
+# Connection pool and retry settings, shared by every module talking to ClickUp or Toggl
+POOL_SIZE = int(os.environ.get('CLICKUP_POOL_SIZE', 20))
+REQUEST_TIMEOUT = float(os.environ.get('CLICKUP_REQUEST_TIMEOUT', 60))
+MAX_RETRIES = int(os.environ.get('CLICKUP_MAX_RETRIES', 5))
+MAX_BACKOFF = 60
+# How many pages of a paginated endpoint are requested ahead at the same time
+PAGE_CONCURRENCY = int(os.environ.get('CLICKUP_PAGE_CONCURRENCY', 4))
+# How many custom field writes are in flight at the same time
+WRITE_CONCURRENCY = int(os.environ.get('CLICKUP_WRITE_CONCURRENCY', 4))
+
+# Tokens that passed validation recently, keyed by token hash
+TOKEN_CACHE_TTL = float(os.environ.get('CLICKUP_TOKEN_CACHE_TTL', 300))
+TOKEN_CACHE_SIZE = int(os.environ.get('CLICKUP_TOKEN_CACHE_SIZE', 1024))
+
+# Server errors are only retried for methods that are safe to repeat
+RETRY_STATUSES = {500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+
+_session = None
+_session_lock = threading.Lock()
+
+validated_tokens = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+# Workspace (team) ids each token can access, checked before serving reports cached for everyone
+token_teams = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
+# Per-host time until which no request is sent, set when any thread hits a rate limit
+_backoff_until: Dict[str, float] = {}
+_backoff_lock = threading.Lock()
+
+
+class ApiError(Exception):
+    """Raised when an upstream API answers with a non-success status after all retries."""
+
+    def __init__(self, response: requests.Response):
+        self.response = response
+        self.status_code = response.status_code
+        super().__init__(f"{response.request.method} {response.url} failed with status "
+                         f"{response.status_code}: {response.text[:500]}")
+
+
+def get_session() -> requests.Session:
+    """Return the process-wide pooled session, creating it on first use.
+
+    Each gunicorn worker gets its own session (and keep-alive pool), shared by all its threads.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def _retry_delay(response: Optional[requests.Response], attempt: int) -> float:
+    """Seconds to wait before the next attempt, honouring rate-limit headers when present."""
+    if response is not None:
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return min(float(retry_after), MAX_BACKOFF)
+            except ValueError:
+                pass
+        # ClickUp sends the unix timestamp (seconds) when the rate-limit window resets
+        reset = response.headers.get('X-RateLimit-Reset')
+        if reset:
+            try:
+                return min(max(float(reset) - time.time(), 0) + 0.5, MAX_BACKOFF)
+            except ValueError:
+                pass
+        # Toggl quota headers
+        resets_in = response.headers.get('X-Toggl-Quota-Resets-In')
+        if resets_in:
+            try:
+                return min(float(resets_in), MAX_BACKOFF)
+            except ValueError:
+                pass
+    return min(2 ** attempt, MAX_BACKOFF)
+
+
+def backoff_remaining(host: str) -> float:
+    """Seconds left before requests to `host` may be sent again after a 429."""
+    return max(_backoff_until.get(host, 0) - time.time(), 0)
+
+
+def _set_backoff(host: str, delay: float):
+    with _backoff_lock:
+        _backoff_until[host] = max(_backoff_until.get(host, 0), time.time() + delay)
+
+
+def next_retry_delay(method: str, url: str, attempt: int, max_retries: int,
+                     response: Optional[requests.Response] = None) -> Optional[float]:
+    """Seconds to wait before retrying an attempt, or None when its outcome is final.
+
+    `response` is None when the attempt failed to connect or timed out. A 429 (or a spent Toggl
+    quota) pauses the whole host (see backoff_remaining) instead of returning a delay.
+    """
+    if attempt >= max_retries:
+        return None
+    if response is None:
+        if method not in IDEMPOTENT_METHODS:
+            return None
+        delay = _retry_delay(None, attempt)
+        print(f"{method} {url} connection failed, retrying in {delay:.1f}s")
+        return delay
+
+    # Toggl answers 402 once the hourly request quota of an organization is spent
+    rate_limited = (response.status_code == 429 or
+                    (response.status_code == 402 and 'X-Toggl-Quota-Resets-In' in response.headers))
+    if response.ok and response.headers.get('X-Toggl-Quota-Remaining') == '0':
+        # Last request of the quota went through: hold the host back before the next one is refused
+        _set_backoff(urlsplit(url).netloc, _retry_delay(response, attempt))
+    retryable = rate_limited or (response.status_code in RETRY_STATUSES and method in IDEMPOTENT_METHODS)
+    if not retryable:
+        return None
+    delay = _retry_delay(response, attempt)
+    print(f"{method} {url} returned {response.status_code}, retrying in {delay:.1f}s")
+    if rate_limited:
+        _set_backoff(urlsplit(url).netloc, delay)
+        return 0
+    return delay
+
+
+def check_response(response: requests.Response) -> requests.Response:
+    if not response.ok:
+        raise ApiError(response)
+    return response
+
+
+def send(method: str, url: str, max_retries: int = MAX_RETRIES, **kwargs) -> requests.Response:
+    """Send a request through the pooled session, retrying on rate limits and transient failures.
+
+    A 429 pauses every thread sending to the same host until the rate-limit window resets.
+    Raises ApiError if the final response is not a success.
+    """
+    method = method.upper()
+    kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+    session = get_session()
+    host = urlsplit(url).netloc
+
+    attempt = 0
+    while True:
+        time.sleep(backoff_remaining(host))
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            observe_request(method, url, 'error', time.perf_counter() - started)
+            delay = next_retry_delay(method, url, attempt, max_retries)
+            if delay is None:
+                raise
+        else:
+            observe_request(method, url, response.status_code, time.perf_counter() - started)
+            delay = next_retry_delay(method, url, attempt, max_retries, response)
+            if delay is None:
+                break
+        time.sleep(delay)
+        attempt += 1
+
+    return check_response(response)
+
+
+def clickup_headers(token: str) -> dict:
+    return {'Authorization': token, 'Content-Type': 'application/json'}
+
+
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def validate_token(token: str) -> bool:
+    """Check the token against ClickUp, trusting a successful check for TOKEN_CACHE_TTL seconds."""
+    key = token_key(token)
+    if validated_tokens.get(key):
+        return True
+    try:
+        clickup_get('user', token)
+    except ApiError:
+        return False
+    validated_tokens.set(key, True)
+    return True
+
+
+def can_access_teams(token: str, team_ids: Iterable[str]) -> bool:
+    """Whether the token belongs to every one of `team_ids`, trusting the answer for TOKEN_CACHE_TTL seconds.
+
+    Any ClickUp account passes validate_token, so results cached across users (reports, the demo
+    list) are only served to tokens that could have fetched them.
+    """
+    key = token_key(token)
+    teams = token_teams.get(key)
+    if teams is None:
+        teams = frozenset(str(team['id']) for team in clickup_get('team', token)['teams'])
+        token_teams.set(key, teams)
+    return {str(team_id) for team_id in team_ids} <= teams
+
+
+def forget_rejected_token(token: str, error: ApiError):
+    """Drop the cached checks of a token ClickUp answered 401 for; shared by the sync and async paths."""
+    if error.status_code == 401:
+        # The token was revoked or expired, stop trusting the cached validation
+        validated_tokens.pop(token_key(token))
+        token_teams.pop(token_key(token))
+
+
+def clickup_request(method: str, path: str, token: str, **kwargs) -> dict:
+    url = f"{CLICKUP_API_URL}/{path.lstrip('/')}"
+    try:
+        response = send(method, url, headers=clickup_headers(token), **kwargs)
+    except ApiError as e:
+        forget_rejected_token(token, e)
+        raise
+    return response.json()
+
+
+def clickup_get(path: str, token: str, params: Optional[dict] = None) -> dict:
+    return clickup_request('GET', path, token, params=params)
+
+
+def clickup_post(path: str, token: str, json: Optional[dict] = None) -> dict:
+    return clickup_request('POST', path, token, json=json)
+
+
+def iter_clickup_pages(path: str, token: str, params: Optional[dict] = None,
+                       concurrency: int = PAGE_CONCURRENCY) -> Iterator[dict]:
+    """Yield the pages of a `page`-paginated ClickUp endpoint in order.
+
+    Up to `concurrency` pages are requested speculatively ahead of the one being consumed;
+    iteration stops at the first page flagged `last_page` (or returning no tasks) and any
+    pages requested past it are discarded.
+    """
+    params = dict(params or {})
+    concurrency = max(1, concurrency)
+
+    def fetch_page(page: int) -> dict:
+        return clickup_get(path, token, params={**params, 'page': page})
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque(executor.submit(fetch_page, page) for page in range(concurrency))
+        next_page = concurrency
+        try:
+            while pending:
+                data = pending.popleft().result()
+                yield data
+                if data.get('last_page', True) or not data.get('tasks'):
+                    break
+                pending.append(executor.submit(fetch_page, next_page))
+                next_page += 1
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def fetch_all_tasks(path: str, token: str, params: Optional[dict] = None,
+                    concurrency: int = PAGE_CONCURRENCY) -> List[dict]:
+    """Fetch every page of a ClickUp task endpoint and return the tasks in page order."""
+    tasks = []
+    for data in iter_clickup_pages(path, token, params, concurrency):
+        tasks.extend(data['tasks'])
+    return tasks
+
+
+@dataclass
+class FieldUpdate:
+    task_id: str
+    field_id: str
+    value: Any
+    # Human readable task reference used in the summary, e.g. the custom id
+    label: str = ''
+
+
+def update_custom_field_values(token: str, updates: List[FieldUpdate], dry_run: bool = False,
+                               concurrency: int = WRITE_CONCURRENCY) -> List[dict]:
+    """Write custom field values on a bounded pool and return one summary row per update.
+
+    With dry_run nothing is sent; the summary lists what would be written.
+    """
+    def apply(update: FieldUpdate) -> dict:
+        result = {'task_id': update.task_id, 'task': update.label, 'field_id': update.field_id,
+                  'value': update.value, 'status': 'would update', 'error': ''}
+        if dry_run:
+            return result
+        try:
+            clickup_post(f"task/{update.task_id}/field/{update.field_id}", token, json={'value': update.value})
+            result['status'] = 'updated'
+        except (ApiError, requests.RequestException) as e:
+            result['status'] = 'failed'
+            result['error'] = str(e)
+        print(f"{result['status']} {update.label or update.task_id} to {update.value}")
+        return result
+
+    if not updates:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        return list(executor.map(apply, updates))
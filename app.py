@@ -1,15 +1,18 @@
 import datetime
 import io
+import itertools
 import os
 import pandas as pd
 
-from flask import Flask, render_template, request, redirect, url_for, session, Response
+from flask import Flask, render_template, request, redirect, url_for, session, Response, jsonify
 import csv
-import requests
 
+from api_client import ApiError, CLICKUP_API_URL, send, token_key, validate_token
 from demo_bot import generate_demo_list, LIST_ID, TEAM_ID
 from disable_logging import disable_logging
-from report import generate_report
+from jobs import get_job, submit_job
+from metrics import render_metrics, span
+from report import iter_report_rows
 from timetracking_report import generate_timetracking_report
 from toggl_sync import sync_clickup_to_toggl
 
@@ -19,25 +22,43 @@ app.config['SERVER_NAME'] = os.environ['CLICKUP_SERVER_NAME']
 app.config['PREFERRED_URL_SCHEME'] = os.environ['CLICKUP_URL_SCHEME']
 
 
-def generate_csv_data(data, fieldnames):
+def iter_csv_data(data, fieldnames, chunk_size=16 * 1024):
+    """Render rows as CSV text, yielding chunks of about `chunk_size` characters as rows arrive."""
     output = io.StringIO()
     writer = csv.DictWriter(output, fieldnames=fieldnames)
     writer.writeheader()
     for row in data:
         writer.writerow(row)
-    return output.getvalue()
+        if output.tell() >= chunk_size:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+    yield output.getvalue()
+
+
+def prefetch_first(rows):
+    """Pull the first row of a lazy pipeline now, so upstream errors raised before it (an ApiError from
+    the first page or store sync) reach the error handlers instead of breaking an already started download."""
+    rows = iter(rows)
+    try:
+        first = next(rows)
+    except StopIteration:
+        return iter(())
+    return itertools.chain([first], rows)
 
 
 def is_token_valid():
     if 'access_token' not in session:
         return False
 
-    token = session['access_token']
-    response = requests.get(
-        'https://api.clickup.com/api/v2/user',
-        headers={'Authorization': token, 'Content-Type': 'application/json'}
-    )
-    return response.status_code == 200
+    return validate_token(session['access_token'])
+
+
+@app.errorhandler(ApiError)
+def handle_api_error(e):
+    if e.status_code == 401:
+        return redirect(url_for('home'))
+    return f"Error: upstream request failed with status {e.status_code}.", 502
 
 
 @app.route('/')
@@ -60,7 +81,8 @@ def generate_demo_report_route():
     slack_message = (f"@here Today is {today.strftime('%A')}! Get ready to demo your work today.\n"
                      f"Make sure your work is included in {title}!")
 
-    md = generate_demo_list(session['access_token'], LIST_ID, TEAM_ID)
+    with span('demo.build'):
+        md = generate_demo_list(session['access_token'], LIST_ID, TEAM_ID)
     return render_template(
         'demo_report.html',
         md=md,
@@ -77,14 +99,23 @@ def generate_report_route():
     if request.method == 'POST':
         list_id = request.form.get('list_id', '10940440')
         refresh_invoiced = request.form.get('refresh_invoiced') == 'on'
+        dry_run = request.form.get('dry_run') == 'on'
 
         token = session['access_token']
-        report_data = generate_report(list_id, token, refresh_invoiced=refresh_invoiced)
+        report_rows = iter_report_rows(list_id, token, refresh_invoiced=refresh_invoiced, dry_run=dry_run)
 
         full_report = ['custom_id', 'name', 'priority', 'tags', 'billable', 'reporter', 'invoiced', 'monthly_reported']
-        csv_data = generate_csv_data(report_data, full_report)
+        if refresh_invoiced:
+            full_report.append('invoiced_update')
+
+        if refresh_invoiced:
+            # Every InvoicedHours write finishes before the download starts, a dropped connection must not skip any
+            report_rows = list(report_rows)
+        else:
+            report_rows = prefetch_first(report_rows)
 
-        response = Response(csv_data, content_type='text/csv')
+        # Streamed as a chunked response: rows go out while later tasks are still being read
+        response = Response(iter_csv_data(report_rows, full_report), content_type='text/csv')
         response.headers.set('Content-Disposition', 'attachment', filename="report.csv")
         return response
 
@@ -99,16 +130,13 @@ def generate_timetrack_route():
     if request.method == 'POST':
         selected_date = datetime.datetime.strptime(request.form['report_date'], '%Y-%m')
         refresh_billable = request.form.get('refresh_billable') == 'on'
+        dry_run = request.form.get('dry_run') == 'on'
+        use_cache = request.form.get('recalculate') != 'on'
         token = session['access_token']
 
-        report_data = generate_timetracking_report(token, selected_date, refresh_billable)
-
-        return render_template(
-            'time_tracking_report.html',
-            final_report=report_data['final_report'].to_html(classes='table table-striped table-hover', index=False, float_format=lambda x: '%.2f' % x),
-            personal_timereport=report_data['personal_timereport'].to_html(classes='table table-striped table-hover', index=False, float_format=lambda x: '%.2f' % x),
-            total=report_data['total'].to_html(classes='table table-striped table-hover', index=False, float_format=lambda x: '%.2f' % x)
-        )
+        job = submit_job('timetrack', token_key(token), generate_timetracking_report, token, selected_date,
+                         refresh_billable=refresh_billable, dry_run=dry_run, use_cache=use_cache)
+        return redirect(url_for('job_route', job_id=job.id))
 
     # Generate list of available dates (current month and 3 months back)
     current_date = datetime.datetime.now().replace(day=1)
@@ -138,17 +166,67 @@ def sync_toggl_route():
         toggl_api_token = request.form['toggl_api_token']
 
         token = session['access_token']
-        result = sync_clickup_to_toggl(token, toggl_api_token, start_date, end_date)
-
-        if isinstance(result, pd.DataFrame):
-            result_table = result.to_html(classes='table table-striped', index=False, escape=False, render_links=True)
-            return render_template('toggl_sync_results.html', result_table=result_table)
-        else:
-            return result  # This will be the "All entries synced successfully" message
+        job = submit_job('toggl', token_key(token), sync_clickup_to_toggl, token, toggl_api_token, start_date, end_date)
+        return redirect(url_for('job_route', job_id=job.id))
 
     return render_template('toggl_sync.html', title="ClickUp to Toggl Time Sync")
 
 
+@span('timetrack.render')
+def render_timetrack_result(report_data, params):
+    update_summary = report_data['update_summary']
+    return render_template(
+        'time_tracking_report.html',
+        final_report=report_data['final_report'].to_html(classes='table table-striped table-hover', index=False, float_format=lambda x: '%.2f' % x),
+        personal_timereport=report_data['personal_timereport'].to_html(classes='table table-striped table-hover', index=False, float_format=lambda x: '%.2f' % x),
+        total=report_data['total'].to_html(classes='table table-striped table-hover', index=False, float_format=lambda x: '%.2f' % x),
+        client_timings=report_data['client_timings'].to_html(classes='table table-striped table-hover', index=False, float_format=lambda x: '%.2f' % x),
+        update_summary=update_summary.to_html(classes='table table-striped table-hover', index=False) if update_summary is not None else None,
+        dry_run=params.get('dry_run', False)
+    )
+
+
+@span('toggl.render')
+def render_toggl_result(result, params):
+    if isinstance(result, pd.DataFrame):
+        result_table = result.to_html(classes='table table-striped', index=False, escape=False, render_links=True)
+        return render_template('toggl_sync_results.html', result_table=result_table)
+    else:
+        return result  # This will be the "All entries synced successfully" message
+
+
+JOB_RESULT_VIEWS = {
+    'timetrack': render_timetrack_result,
+    'toggl': render_toggl_result,
+}
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_route(job_id):
+    if not is_token_valid():
+        return redirect(url_for('home'))
+
+    job = get_job(job_id, token_key(session['access_token']))
+    if job is None:
+        return "Error: job not found or expired.", 404
+
+    if job.status == 'done':
+        return JOB_RESULT_VIEWS[job.kind](job.result, job.params)
+
+    return render_template('job_status.html', title="Working on it", job=job.to_dict())
+
+
+@app.route('/jobs/<job_id>/status', methods=['GET'])
+def job_status_route(job_id):
+    if not is_token_valid():
+        return jsonify({'error': 'unauthorized'}), 401
+
+    job = get_job(job_id, token_key(session['access_token']))
+    if job is None:
+        return jsonify({'error': 'job not found or expired'}), 404
+    return jsonify(job.to_dict())
+
+
 @app.route('/report', methods=['GET'])
 def reports_list_route():
     return render_template('reports_list.html', title="Report Links")
@@ -165,17 +243,18 @@ def callback():
     client_secret = os.environ['CLICKUP_CLIENT_SECRET']
     redirect_uri = url_for('callback', _external=True)
 
-    r = requests.post(
-        url='https://api.clickup.com/api/v2/oauth/token',
-        data={
-            'code': code,
-            'client_id': client_id,
-            'client_secret': client_secret,
-            'redirect_uri': redirect_uri,
-        },
-    )
-
-    if r.status_code != 200:
+    try:
+        r = send(
+            'POST',
+            f'{CLICKUP_API_URL}/oauth/token',
+            data={
+                'code': code,
+                'client_id': client_id,
+                'client_secret': client_secret,
+                'redirect_uri': redirect_uri,
+            },
+        )
+    except ApiError:
         return "Error: Failed to get access token."
 
     access_token = r.json()['access_token']
@@ -190,5 +269,11 @@ def health_check():
     return "OK", 200
 
 
+@app.route("/metrics", methods=["GET"])
+@disable_logging
+def metrics_route():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == '__main__':
     app.run()
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+from urllib.parse import urlsplit
+
+import requests
+
+from api_client import (CLICKUP_API_URL, MAX_RETRIES, REQUEST_TIMEOUT, ApiError, backoff_remaining, check_response,
+                        clickup_headers, forget_rejected_token, get_session, next_retry_delay)
+from metrics import observe_request
+
+# Upstream calls in flight at the same time within one async run
+ASYNC_CONCURRENCY = int(os.environ.get('CLICKUP_ASYNC_CONCURRENCY', 16))
+# Time entry queries are split into windows of this many days ...
+TIME_ENTRY_WINDOW_DAYS = float(os.environ.get('CLICKUP_TIME_ENTRY_WINDOW_DAYS', 7))
+# ... and into batches of at most this many assignees, keeping URLs and payloads small
+TIME_ENTRY_ASSIGNEE_BATCH = int(os.environ.get('CLICKUP_TIME_ENTRY_ASSIGNEE_BATCH', 20))
+
+T = TypeVar('T')
+
+# Blocking socket work of every async run in this worker goes through this fixed pool, so
+# the number of threads stays at ASYNC_CONCURRENCY no matter how many calls are pending.
+_io_executor = ThreadPoolExecutor(max_workers=ASYNC_CONCURRENCY, thread_name_prefix='async-io')
+
+
+class AsyncApi:
+    """Coroutine interface to ClickUp and Toggl with a semaphore-based concurrency limit.
+
+    Hundreds of calls can be awaited at once from a single event loop thread; at most
+    `concurrency` of them are on the wire, each reusing the worker's pooled keep-alive session.
+    Retries, 429 host pauses and ApiError follow api_client.send, but waits are asyncio sleeps
+    that do not hold a connection slot.
+    """
+
+    def __init__(self, concurrency: int = ASYNC_CONCURRENCY):
+        self._semaphore = asyncio.Semaphore(max(1, min(concurrency, ASYNC_CONCURRENCY)))
+
+    async def send(self, method: str, url: str, max_retries: int = MAX_RETRIES, **kwargs) -> requests.Response:
+        method = method.upper()
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        request = partial(get_session().request, method, url, **kwargs)
+        host = urlsplit(url).netloc
+        loop = asyncio.get_running_loop()
+
+        attempt = 0
+        while True:
+            await asyncio.sleep(backoff_remaining(host))
+            try:
+                async with self._semaphore:
+                    started = time.perf_counter()
+                    try:
+                        response = await loop.run_in_executor(_io_executor, request)
+                    finally:
+                        elapsed = time.perf_counter() - started
+            except (requests.ConnectionError, requests.Timeout):
+                observe_request(method, url, 'error', elapsed)
+                delay = next_retry_delay(method, url, attempt, max_retries)
+                if delay is None:
+                    raise
+            else:
+                observe_request(method, url, response.status_code, elapsed)
+                delay = next_retry_delay(method, url, attempt, max_retries, response)
+                if delay is None:
+                    break
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        return check_response(response)
+
+    async def clickup_request(self, method: str, path: str, token: str, **kwargs) -> dict:
+        url = f"{CLICKUP_API_URL}/{path.lstrip('/')}"
+        try:
+            response = await self.send(method, url, headers=clickup_headers(token), **kwargs)
+        except ApiError as e:
+            forget_rejected_token(token, e)
+            raise
+        return response.json()
+
+    async def clickup_get(self, path: str, token: str, params: Optional[dict] = None) -> dict:
+        return await self.clickup_request('GET', path, token, params=params)
+
+    async def gather(self, calls: Iterable[Awaitable[T]], return_exceptions: bool = False) -> List[T]:
+        """Await many calls at once, results in input order."""
+        return await asyncio.gather(*calls, return_exceptions=return_exceptions)
+
+
+async def fetch_tasks_details(api: AsyncApi, token: str, task_ids: Iterable[str]) -> Dict[str, dict]:
+    task_ids = list(task_ids)
+    tasks = await api.gather(api.clickup_get(f"task/{task_id}", token) for task_id in task_ids)
+    return dict(zip(task_ids, tasks))
+
+
+def split_window(start: int, end: int, window_days: float = TIME_ENTRY_WINDOW_DAYS) -> List[Tuple[int, int]]:
+    """Split the inclusive millisecond range [start, end] into consecutive non-overlapping slices."""
+    step = max(int(window_days * 24 * 60 * 60 * 1000), 1)
+    return [(slice_start, min(slice_start + step - 1, end)) for slice_start in range(start, end + 1, step)]
+
+
+async def fetch_time_entries(api: AsyncApi, token: str, team_id: str, start: int, end: int,
+                             params: Optional[dict] = None, assignees: Optional[List] = None,
+                             window_days: float = TIME_ENTRY_WINDOW_DAYS,
+                             assignee_batch: int = TIME_ENTRY_ASSIGNEE_BATCH) -> List[dict]:
+    """Fetch /team/{id}/time_entries for [start, end] as concurrent date-window x assignee-batch slices.
+
+    Slices are merged in window order and de-duplicated by entry id. `assignees` of None leaves the
+    assignee filter out, like the single-request call it replaces.
+    """
+    if assignees is None:
+        batches = [None]
+    else:
+        assignees = [str(assignee) for assignee in assignees]
+        batch = max(1, assignee_batch)
+        batches = [assignees[i:i + batch] for i in range(0, len(assignees), batch)] or [[]]
+
+    queries = []
+    for window_start, window_end in split_window(start, end, window_days):
+        for batch_assignees in batches:
+            query = {**(params or {}), 'start_date': window_start, 'end_date': window_end}
+            if batch_assignees is not None:
+                query['assignee'] = ','.join(batch_assignees)
+            queries.append(query)
+
+    responses = await api.gather(api.clickup_get(f"team/{team_id}/time_entries", token, params=query)
+                                 for query in queries)
+    entries = {}
+    for response in responses:
+        for entry in response['data']:
+            entries.setdefault(entry['id'], entry)
+    return list(entries.values())
+
+
+def run_async(func: Callable[..., Awaitable[T]], *args: Any, concurrency: int = ASYNC_CONCURRENCY, **kwargs: Any) -> T:
+    """Sync adapter for Flask routes and jobs: run `func(api, *args, **kwargs)` on a fresh event loop."""
+    async def main():
+        return await func(AsyncApi(concurrency), *args, **kwargs)
+
+    return asyncio.run(main())
@@ -0,0 +1,73 @@
+"""Compare peak memory of accumulating per-client task/time frames: object columns vs the compact form.
+
+    python -m benchmarks.accumulation [clients] [tasks per client] [entries per client]
+"""
+import sys
+
+import pandas as pd
+
+from benchmarks.rollup import generate_final_report_merge
+from benchmarks.synthetic import make_tasks, make_time_entries, measure, report
+from timetracking_report import (add_durations, calculate_personal_timereport, concat_compact, constant_category,
+                                 generate_final_report, project_tasks, project_time_entries)
+
+
+def accumulate_objects(payloads):
+    """The previous representation: json_normalize'd entries and object `client`/username columns."""
+    all_tasks, all_time = [], []
+    for name, tasks, entries in payloads:
+        tasks_data = project_tasks([tasks])
+        tasks_data['client'] = name
+        time_report_data = pd.json_normalize(entries)[['user.username', 'duration', 'task.id', 'task.custom_id',
+                                                       'task.name']]
+        time_report_data['duration'] = pd.to_numeric(time_report_data['duration'], errors='coerce')
+        add_durations(time_report_data)
+        time_report_data['client'] = name
+        all_tasks.append(tasks_data)
+        all_time.append(time_report_data)
+    return pd.concat(all_tasks), pd.concat(all_time)
+
+
+def accumulate_compact(payloads):
+    all_tasks, all_time = [], []
+    for name, tasks, entries in payloads:
+        tasks_data = project_tasks([tasks])
+        tasks_data['client'] = constant_category(name, len(tasks_data))
+        del tasks_data['assignees']
+        time_report_data = add_durations(project_time_entries(entries))
+        time_report_data['client'] = constant_category(name, len(time_report_data))
+        all_tasks.append(tasks_data)
+        all_time.append(time_report_data)
+    return concat_compact(all_tasks), concat_compact(all_time)
+
+
+def frame_bytes(*frames: pd.DataFrame) -> int:
+    return sum(int(frame.memory_usage(deep=True).sum()) for frame in frames)
+
+
+def main(client_count: int = 4, task_count: int = 10_000, entry_count: int = 50_000):
+    payloads = []
+    for i in range(client_count):
+        tasks = make_tasks(task_count, list_id=f'L{i}', seed=i)
+        payloads.append((f'Client {i}', tasks, make_time_entries(entry_count, tasks, seed=100 + i)))
+
+    objects = accumulate_objects(payloads)
+    compact = accumulate_compact(payloads)
+    pd.testing.assert_frame_equal(generate_final_report_merge(*objects), generate_final_report(*compact),
+                                  check_exact=True)
+    pd.testing.assert_frame_equal(calculate_personal_timereport(objects[1]).reset_index(drop=True),
+                                  calculate_personal_timereport(compact[1]).reset_index(drop=True),
+                                  check_exact=True, check_dtype=False, check_categorical=False)
+
+    print(f"{client_count} clients x {task_count} tasks, {entry_count} time entries")
+    print(f"{'accumulated frames, object columns':<40} {frame_bytes(*objects) / 1024 / 1024:10.1f} MiB")
+    print(f"{'accumulated frames, compact':<40} {frame_bytes(*compact) / 1024 / 1024:10.1f} MiB")
+    before = measure(lambda: generate_final_report_merge(*accumulate_objects(payloads)), repeat=1)
+    after = measure(lambda: generate_final_report(*accumulate_compact(payloads)), repeat=1)
+    report('object columns + merge chain', *before)
+    report('compact + rollup', *after)
+    print(f"peak memory: {before[1] / after[1]:.1f}x lower")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,42 @@
+"""Compare row-wise and vectorized TotalDuration/AdjustedDuration on a synthetic busy month.
+
+    python -m benchmarks.durations [entries]
+"""
+import sys
+
+import pandas as pd
+
+from benchmarks.synthetic import make_tasks, make_time_entries, measure, report
+from timetracking_report import add_durations, developer_coefficients
+
+
+def add_durations_rowwise(time_report_data: pd.DataFrame) -> pd.DataFrame:
+    """The previous DataFrame.apply(axis=1) implementation, kept as the baseline."""
+    def calculate_adjusted_duration(row):
+        if row['user.username'] in developer_coefficients:
+            return row['duration'] / 60 / 60 / 1000 / developer_coefficients[row['user.username']]
+        else:
+            return row['duration'] / 60 / 60 / 1000 / 1
+
+    time_report_data['TotalDuration'] = time_report_data.apply(lambda row: row['duration'] / 60 / 60 / 1000, axis=1)
+    time_report_data['AdjustedDuration'] = time_report_data.apply(calculate_adjusted_duration, axis=1)
+    return time_report_data
+
+
+def main(count: int = 100_000):
+    entries = make_time_entries(count, make_tasks(2_000))
+    frame = pd.json_normalize(entries)[['user.username', 'duration', 'task.id', 'task.custom_id', 'task.name']]
+    frame['duration'] = pd.to_numeric(frame['duration'], errors='coerce')
+
+    pd.testing.assert_frame_equal(add_durations_rowwise(frame.copy()), add_durations(frame.copy()))
+
+    print(f"{count} time entries")
+    rowwise = measure(lambda: add_durations_rowwise(frame.copy()), repeat=1)
+    vectorized = measure(lambda: add_durations(frame.copy()))
+    report('apply(axis=1)', *rowwise)
+    report('vectorized', *vectorized)
+    print(f"speedup: {rowwise[0] / vectorized[0]:.0f}x")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
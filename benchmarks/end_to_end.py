@@ -0,0 +1,139 @@
+"""Time the reports, the Toggl sync and the demo list end to end against benchmarks/fake_api.py.
+
+    python -m benchmarks.end_to_end [--tasks 2000] [--entries 2000] [--latency 0.02] [--runs 2] [scenario ...]
+
+The fake API runs in its own process. Every scenario runs in a fresh interpreter, so the peak RSS
+reported is its own, `--runs` times in a row against one task store and Toggl ledger: the first
+run is cold, later ones show what the store, ledger and incremental syncs save. Upstream calls are
+counted by the fake API per endpoint.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.fake_api import MONTH_START
+
+TOKEN = 'benchmark-token'
+TOGGL_TOKEN = 'benchmark-toggl-token'
+DAY = 24 * 60 * 60 * 1000
+
+
+def quiet(message: str):
+    pass
+
+
+def run_billable():
+    from client import clients
+    from report import generate_report
+    generate_report(clients[0].list_id, TOKEN)
+
+
+def run_timetrack():
+    from timetracking_report import generate_timetracking_report
+    generate_timetracking_report(TOKEN, datetime.datetime.fromtimestamp(MONTH_START / 1000 + 14 * 24 * 60 * 60),
+                                 progress=quiet)
+
+
+def run_toggl():
+    from toggl_sync import sync_clickup_to_toggl
+    sync_clickup_to_toggl(TOKEN, TOGGL_TOKEN, MONTH_START, MONTH_START + 30 * DAY - 1, progress=quiet)
+
+
+def run_demo():
+    from demo_bot import LIST_ID, TEAM_ID, generate_demo_list
+    generate_demo_list(TOKEN, LIST_ID, TEAM_ID)
+
+
+SCENARIOS = {
+    'billable': run_billable,
+    'timetrack': run_timetrack,
+    'toggl': run_toggl,
+    'demo': run_demo,
+}
+
+
+def _call(url: str, method: str = 'GET') -> dict:
+    with urllib.request.urlopen(urllib.request.Request(url, method=method)) as response:
+        return json.loads(response.read())
+
+
+def run_scenario(name: str, api: str):
+    """Child process: run one scenario and print its measurements as JSON on the last stdout line."""
+    _call(f'{api}/__reset', 'POST')
+    # Progress output of the app goes to stderr, stdout carries the result
+    with contextlib.redirect_stdout(sys.stderr):
+        started = time.perf_counter()
+        SCENARIOS[name]()
+        seconds = time.perf_counter() - started
+    print(json.dumps({
+        'seconds': seconds,
+        'calls': _call(f'{api}/__stats'),
+        # Linux reports ru_maxrss in KiB
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('scenarios', nargs='*', metavar='scenario', help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument('--tasks', type=int, default=2000, help='tasks per list or view')
+    parser.add_argument('--entries', type=int, default=2000, help='time entries per list')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per fake API response')
+    parser.add_argument('--runs', type=int, default=2)
+    parser.add_argument('--verbose', action='store_true', help="show the app's own output")
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--api', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        run_scenario(args.scenario, args.api)
+        return
+    unknown = set(args.scenarios) - SCENARIOS.keys()
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix='clickup-bench-')
+    server = subprocess.Popen([sys.executable, '-m', 'benchmarks.fake_api', '--port', '0',
+                               '--tasks', str(args.tasks), '--entries', str(args.entries),
+                               '--latency', str(args.latency)],
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        api = server.stdout.readline().split()[-1]
+        env = {
+            **os.environ,
+            'CLICKUP_API_URL': f'{api}/api/v2',
+            'CLICKUP_TOGGL_API_URL': f'{api}/api/v9',
+            'CLICKUP_STORE_PATH': os.path.join(workdir, 'store.sqlite3'),
+            'CLICKUP_TOGGL_LEDGER_PATH': os.path.join(workdir, 'toggl-ledger.sqlite3'),
+        }
+        print(f"{args.tasks} tasks per list, {args.entries} time entries per list, {args.latency * 1000:.0f} ms latency")
+        print(f"{'scenario':<10} {'run':>3} {'time':>12} {'calls':>7} {'peak RSS':>14}")
+        for name in args.scenarios or SCENARIOS:
+            for run in range(1, args.runs + 1):
+                child = subprocess.run([sys.executable, '-m', 'benchmarks.end_to_end', '--scenario', name,
+                                        '--api', api],
+                                       env=env, stdout=subprocess.PIPE, stderr=None if args.verbose else subprocess.DEVNULL,
+                                       text=True, check=True)
+                result = json.loads(child.stdout.strip().splitlines()[-1])
+                calls = result['calls']
+                print(f"{name:<10} {run:>3} {result['seconds'] * 1000:9.1f} ms {sum(calls.values()):>7} "
+                      f"{result['peak_rss'] / 1024 / 1024:9.1f} MiB")
+                for endpoint, count in sorted(calls.items(), key=lambda item: -item[1]):
+                    print(f"{'':<15}{count:>7}  {endpoint}")
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
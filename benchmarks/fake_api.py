@@ -0,0 +1,231 @@
+"""Local stand-in for the ClickUp and Toggl APIs, serving synthetic data for offline benchmarks.
+
+    python -m benchmarks.fake_api [--port 8765] [--tasks 2000] [--entries 10000] [--latency 0.05]
+
+Point the app at it with CLICKUP_API_URL=http://127.0.0.1:8765/api/v2 and
+CLICKUP_TOGGL_API_URL=http://127.0.0.1:8765/api/v9. Every list or view id has `--tasks` tasks and
+`--entries` time entries in the month starting at `--month-start`. GET /__stats returns request
+counts per endpoint, POST /__reset clears them.
+"""
+import argparse
+import json
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from benchmarks.synthetic import make_tasks, make_time_entries
+from metrics import endpoint_label
+
+PAGE_SIZE = 100
+# 2023-11-01T00:00:00Z
+MONTH_START = 1_698_796_800_000
+
+ROUTES = [
+    ('GET', re.compile(r'^/api/v2/(?:list|view)/(?P<list_id>[^/]+)/task$'), 'list_tasks'),
+    ('GET', re.compile(r'^/api/v2/team/(?P<team_id>[^/]+)/time_entries$'), 'time_entries'),
+    ('GET', re.compile(r'^/api/v2/team/(?P<team_id>[^/]+)/space$'), 'spaces'),
+    ('GET', re.compile(r'^/api/v2/task/(?P<task_id>[^/]+)$'), 'task'),
+    ('POST', re.compile(r'^/api/v2/task/(?P<task_id>[^/]+)/field/(?P<field_id>[^/]+)$'), 'set_field'),
+    ('GET', re.compile(r'^/api/v2/user$'), 'user'),
+    ('GET', re.compile(r'^/api/v2/team$'), 'teams'),
+    ('GET', re.compile(r'^/api/v9/workspaces/(?P<workspace_id>[^/]+)/tasks$'), 'toggl_tasks'),
+    ('POST', re.compile(r'^/api/v9/workspaces/(?P<workspace_id>[^/]+)/time_entries$'), 'toggl_create'),
+    ('PUT', re.compile(r'^/api/v9/workspaces/(?P<workspace_id>[^/]+)/time_entries/(?P<entry_id>\d+)$'),
+     'toggl_update'),
+    ('DELETE', re.compile(r'^/api/v9/workspaces/(?P<workspace_id>[^/]+)/time_entries/(?P<entry_id>\d+)$'),
+     'toggl_delete'),
+]
+
+
+@dataclass
+class FakeApiConfig:
+    tasks: int = 2000
+    entries: int = 10000
+    spaces: int = 5
+    toggl_tasks: int = 60
+    # Seconds added to every response
+    latency: float = 0.0
+    month_start: int = MONTH_START
+    # Workspace every token belongs to
+    team_id: str = '2454960'
+
+
+class FakeApi:
+    """Synthetic ClickUp/Toggl state; lists are generated on first use, deterministically per id."""
+
+    def __init__(self, config: FakeApiConfig):
+        self.config = config
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._tasks: Dict[str, List[dict]] = {}
+        self._entries: Dict[str, List[dict]] = {}
+        self._toggl_entry_ids = iter(range(1, 1 << 62))
+
+    def tasks(self, list_id: str) -> List[dict]:
+        with self._lock:
+            if list_id not in self._tasks:
+                tasks = make_tasks(self.config.tasks, list_id=list_id, seed=zlib.crc32(list_id.encode()))
+                for i, task in enumerate(tasks):
+                    task['space'] = {'id': f'S{i % self.config.spaces}'}
+                self._tasks[list_id] = tasks
+            return self._tasks[list_id]
+
+    def entries(self, list_id: str) -> List[dict]:
+        tasks = self.tasks(list_id)
+        with self._lock:
+            if list_id not in self._entries:
+                self._entries[list_id] = make_time_entries(self.config.entries, tasks, start=self.config.month_start,
+                                                           seed=zlib.crc32(list_id.encode()) + 1)
+            return self._entries[list_id]
+
+    def handle(self, method: str, path: str, query: Dict[str, str], body: Optional[dict]) -> Tuple[int, dict]:
+        if path == '/__stats':
+            with self._lock:
+                return 200, dict(self.calls)
+        if path == '/__reset':
+            with self._lock:
+                self.calls.clear()
+            return 200, {}
+
+        with self._lock:
+            self.calls[f'{method} {endpoint_label(path)[1]}'] += 1
+        if self.config.latency:
+            time.sleep(self.config.latency)
+
+        for route_method, pattern, name in ROUTES:
+            match = pattern.match(path)
+            if match and route_method == method:
+                return getattr(self, name)(query=query, body=body, **match.groupdict())
+        return 404, {'err': f'{method} {path} is not served by the fake API'}
+
+    def list_tasks(self, list_id: str, query: Dict[str, str], **_) -> Tuple[int, dict]:
+        tasks = self.tasks(list_id)
+        if query.get('subtasks') != 'true':
+            tasks = [task for task in tasks if not task['parent']]
+        if 'date_updated_gt' in query:
+            tasks = [task for task in tasks if int(task['date_updated']) > int(query['date_updated_gt'])]
+        for condition in json.loads(query.get('custom_fields', '[]')):
+            # Only the '>' filter of the billable report is needed
+            def value(task):
+                for field in task['custom_fields']:
+                    if field['id'] == condition['field_id'] and field.get('value') not in (None, ''):
+                        return float(field['value'])
+                return None
+            tasks = [task for task in tasks if value(task) is not None and value(task) > float(condition['value'])]
+
+        page = int(query.get('page', 0))
+        return 200, {'tasks': tasks[page * PAGE_SIZE:(page + 1) * PAGE_SIZE],
+                     'last_page': (page + 1) * PAGE_SIZE >= len(tasks)}
+
+    def time_entries(self, query: Dict[str, str], **_) -> Tuple[int, dict]:
+        list_ids = [query['list_id']] if 'list_id' in query else list(self._tasks)
+        start = int(query.get('start_date', 0))
+        end = int(query.get('end_date', 1 << 62))
+        assignees = {int(a) for a in query['assignee'].split(',') if a} if query.get('assignee') else None
+        entries = [entry for list_id in list_ids for entry in self.entries(list_id)
+                   if start <= int(entry['start']) <= end and (assignees is None or entry['user']['id'] in assignees)]
+        return 200, {'data': entries}
+
+    def spaces(self, **_) -> Tuple[int, dict]:
+        return 200, {'spaces': [{'id': f'S{i}', 'name': f'Space {i}'} for i in range(self.config.spaces)]}
+
+    def task(self, task_id: str, **_) -> Tuple[int, dict]:
+        list_id = task_id.rsplit('-', 1)[0]
+        for task in self.tasks(list_id):
+            if task['id'] == task_id:
+                return 200, task
+        return 404, {'err': 'Task not found'}
+
+    def set_field(self, **_) -> Tuple[int, dict]:
+        return 200, {}
+
+    def user(self, **_) -> Tuple[int, dict]:
+        return 200, {'user': {'id': 1, 'username': 'benchmark'}}
+
+    def teams(self, **_) -> Tuple[int, dict]:
+        return 200, {'teams': [{'id': self.config.team_id, 'name': 'Benchmark'}]}
+
+    def toggl_tasks(self, query: Dict[str, str], **_) -> Tuple[int, dict]:
+        page = int(query.get('page', 1))
+        per_page = int(query.get('per_page', 1000))
+        tasks = [{'id': 5000 + i, 'name': f'Toggl {i}', 'project_id': 1, 'active': True}
+                 for i in range(self.config.toggl_tasks)]
+        return 200, {'data': tasks[(page - 1) * per_page:page * per_page], 'total_count': len(tasks)}
+
+    def toggl_create(self, body: dict, **_) -> Tuple[int, dict]:
+        with self._lock:
+            entry_id = next(self._toggl_entry_ids)
+        return 200, {**body, 'id': entry_id}
+
+    def toggl_update(self, entry_id: str, body: dict, **_) -> Tuple[int, dict]:
+        return 200, {**body, 'id': int(entry_id)}
+
+    def toggl_delete(self, **_) -> Tuple[int, dict]:
+        return 200, {}
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real APIs, so the client's connection pool is exercised
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without TCP_NODELAY every response waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def _dispatch(self):
+        parts = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        status, payload = self.server.api.handle(self.command, parts.path, query, body)
+
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(config: FakeApiConfig, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    """Create the server (port 0 picks a free one); call serve_forever() on it."""
+    server = ThreadingHTTPServer((host, port), FakeApiHandler)
+    server.daemon_threads = True
+    server.api = FakeApi(config)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--tasks', type=int, default=FakeApiConfig.tasks, help='tasks per list or view')
+    parser.add_argument('--entries', type=int, default=FakeApiConfig.entries, help='time entries per list')
+    parser.add_argument('--spaces', type=int, default=FakeApiConfig.spaces)
+    parser.add_argument('--toggl-tasks', type=int, default=FakeApiConfig.toggl_tasks)
+    parser.add_argument('--latency', type=float, default=FakeApiConfig.latency, help='seconds per response')
+    parser.add_argument('--month-start', type=int, default=MONTH_START, help='first entry start, ms')
+    args = parser.parse_args()
+
+    server = serve(FakeApiConfig(tasks=args.tasks, entries=args.entries, spaces=args.spaces,
+                                 toggl_tasks=args.toggl_tasks, latency=args.latency, month_start=args.month_start),
+                   args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"fake API listening on http://{host}:{port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Check the rollup engine against the former merge/groupby chain and compare them on a large month.
+
+    python -m benchmarks.rollup [tasks] [entries]
+"""
+import random
+import sys
+
+import pandas as pd
+
+from benchmarks.synthetic import make_tasks, make_time_entries, measure, report
+from timetracking_report import add_durations, generate_final_report, project_tasks
+
+
+def generate_final_report_merge(tasks_data: pd.DataFrame, time_report_data: pd.DataFrame) -> pd.DataFrame:
+    """The previous three-merge implementation, kept as the golden reference."""
+    merged_df = pd.merge(tasks_data, time_report_data, left_on=['id', 'client'], right_on=['task.id', 'client'],
+                         how='left')
+    merged_df['parent'] = merged_df['parent'].fillna(merged_df['id'])
+
+    grouped_df = merged_df.groupby(['parent', 'id', 'client'])['AdjustedDuration'].sum().reset_index()
+
+    final_report = pd.merge(grouped_df, tasks_data[['id', 'client']], left_on=['parent', 'client'],
+                            right_on=['id', 'client'])
+    final_report = final_report.rename(columns={'id_y': 'id'})
+    final_report = final_report.drop(columns=['parent', 'id_x'])
+    final_report = final_report[final_report['AdjustedDuration'] != 0]
+    final_report['AdjustedDuration'] = (round(final_report['AdjustedDuration'] * 2) / 2)
+    final_report = final_report.groupby(['id', 'client'])['AdjustedDuration'].sum().reset_index()
+
+    final_report = pd.merge(final_report, tasks_data[['id', 'name', 'custom_id', 'InvoicedHours', 'client']],
+                            left_on=['id', 'client'], right_on=['id', 'client'])
+    final_report = final_report.sort_values(['client', 'AdjustedDuration'], ascending=[True, False])
+
+    return final_report
+
+
+def make_month(task_count: int, entry_count: int, seed: int = 3):
+    """Tasks and time entries of two clients, with the awkward cases of real lists mixed in."""
+    rng = random.Random(seed)
+    tasks_frames, time_frames = [], []
+    for client, list_id in (('Insly', 'L1'), ('CI', 'L2')):
+        tasks = make_tasks(task_count, list_id=list_id, seed=seed)
+        for task in tasks[::50]:
+            # Second-level subtasks and subtasks of tasks missing from the list
+            task['parent'] = rng.choice([tasks[rng.randrange(len(tasks))]['id'], f'{list_id}-archived'])
+        entries = make_time_entries(entry_count, tasks, seed=seed + 1)
+        for entry in entries[::7]:
+            # Quarter hours land exactly on the half-hour rounding boundary
+            entry['duration'] = str(rng.choice([0, 15, 45, 75, -30]) * 60 * 1000)
+        for entry in entries[::97]:
+            entry['task']['id'] = f'{list_id}-unknown'
+        entries[1]['duration'] = None
+
+        tasks_data = project_tasks([tasks])
+        tasks_data['client'] = client
+        time_report_data = pd.json_normalize(entries)[['user.username', 'duration', 'task.id', 'task.custom_id',
+                                                       'task.name']]
+        time_report_data['duration'] = pd.to_numeric(time_report_data['duration'], errors='coerce')
+        add_durations(time_report_data)
+        time_report_data['client'] = client
+        tasks_frames.append(tasks_data)
+        time_frames.append(time_report_data)
+    return pd.concat(tasks_frames), pd.concat(time_frames)
+
+
+def main(task_count: int = 20_000, entry_count: int = 200_000):
+    for seed in range(5):
+        tasks_data, time_report_data = make_month(500, 3_000, seed=seed)
+        pd.testing.assert_frame_equal(generate_final_report_merge(tasks_data, time_report_data),
+                                      generate_final_report(tasks_data, time_report_data), check_exact=True)
+
+    tasks_data, time_report_data = make_month(task_count, entry_count)
+    expected = generate_final_report_merge(tasks_data, time_report_data)
+    pd.testing.assert_frame_equal(expected, generate_final_report(tasks_data, time_report_data), check_exact=True)
+
+    print(f"2 clients x {task_count} tasks, {entry_count} time entries, {len(expected)} report rows")
+    merge = measure(lambda: generate_final_report_merge(tasks_data, time_report_data))
+    rollup = measure(lambda: generate_final_report(tasks_data, time_report_data))
+    report('merge chain', *merge)
+    report('rollup', *rollup)
+    print(f"speedup: {merge[0] / rollup[0]:.1f}x, peak memory: {merge[1] / rollup[1]:.1f}x lower")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,58 @@
+"""Check the linear-scan shift_overlaps against the previous per-task implementation and time both.
+
+    python -m benchmarks.shift_overlaps [entries] [tasks]
+"""
+import sys
+
+import pandas as pd
+
+from benchmarks.synthetic import make_tasks, make_time_entries, measure, report
+from toggl_sync import shift_overlaps
+
+
+def shift_overlaps_iterrows(time_entries: pd.DataFrame) -> pd.DataFrame:
+    """The previous per-group implementation, kept as the reference."""
+    time_entries = time_entries.sort_values('start')
+    shifted_entries = []
+
+    for i, entry in time_entries.iterrows():
+        if not shifted_entries or entry['start'] >= shifted_entries[-1]['end']:
+            shifted_entries.append(entry)
+        else:
+            new_start = shifted_entries[-1]['end']
+            duration = entry['duration']
+            new_end = new_start + duration
+
+            shifted_entry = entry.copy()
+            shifted_entry['start'] = new_start
+            shifted_entry['end'] = new_end
+            shifted_entries.append(shifted_entry)
+
+    return pd.DataFrame(shifted_entries)
+
+
+def shift_per_task(time_entries: pd.DataFrame) -> pd.DataFrame:
+    """What sync_clickup_to_toggl used to do: one call per task group, growing the result with concat."""
+    shifted_entries = pd.DataFrame()
+    for _, group in time_entries.groupby('task.id'):
+        shifted_entries = pd.concat([shifted_entries, shift_overlaps_iterrows(group)])
+    return shifted_entries
+
+
+def main(count: int = 20_000, task_count: int = 500):
+    entries = pd.json_normalize(make_time_entries(count, make_tasks(task_count)))
+    entries = entries[['id', 'task.id', 'task.name', 'user.username', 'duration', 'start', 'end']]
+    for column in ('start', 'end', 'duration'):
+        entries[column] = entries[column].astype('int64')
+
+    expected = shift_per_task(entries).astype(entries.dtypes.to_dict()).reset_index(drop=True)
+    actual = shift_overlaps(entries).reset_index(drop=True)
+    pd.testing.assert_frame_equal(expected, actual)
+    print(f"{count} entries over {task_count} tasks")
+
+    report('iterrows per task + concat', *measure(lambda: shift_per_task(entries), repeat=1))
+    report('linear scan', *measure(lambda: shift_overlaps(entries)))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,98 @@
+"""Synthetic ClickUp payloads and small timing helpers shared by the benchmark scripts."""
+import random
+import time
+import tracemalloc
+from typing import Callable, List, Tuple
+
+from report import BILLABLE_ID, INVOICED_ID
+from timetracking_report import developer_coefficients
+
+USERNAMES = list(developer_coefficients) + ['Unknown Contractor', 'Another Contractor']
+HOUR = 60 * 60 * 1000
+
+
+def make_users(count: int = len(USERNAMES)) -> List[dict]:
+    return [{'id': 1000 + i, 'username': USERNAMES[i % len(USERNAMES)] if i < len(USERNAMES) else f'User {i}'}
+            for i in range(count)]
+
+
+def make_tasks(count: int, list_id: str = 'L1', subtask_ratio: float = 0.3, seed: int = 1) -> List[dict]:
+    """Task payloads shaped like the list task endpoint, with roughly `subtask_ratio` of them being subtasks."""
+    rng = random.Random(seed)
+    users = make_users()
+    tasks = []
+    for i in range(count):
+        task_id = f'{list_id}-{i}'
+        parent = None
+        if i and rng.random() < subtask_ratio:
+            # Point at the root so subtasks are one level deep, as in our lists
+            candidate = tasks[rng.randrange(i)]
+            parent = candidate['parent'] or candidate['id']
+        tasks.append({
+            'id': task_id,
+            'custom_id': f'CU-{i}',
+            'name': f'<b>Task</b> {i}',
+            'parent': parent,
+            'date_created': str(1_600_000_000_000 + i * 1000),
+            'date_updated': str(1_600_000_000_000 + i * 1000),
+            'text_content': 'lorem ipsum ' * 20,
+            'description': 'lorem ipsum ' * 20,
+            'status': {'status': 'open', 'color': '#fff', 'type': 'open', 'orderindex': 1},
+            'creator': {'id': 1, 'username': 'creator', 'color': '#000', 'email': 'c@example.com',
+                        'profilePicture': None},
+            'assignees': [users[rng.randrange(len(users))]],
+            'watchers': [], 'checklists': [], 'tags': [],
+            'priority': None,
+            'space': {'id': 'S1'},
+            'list': {'id': list_id, 'name': 'List', 'access': True},
+            'folder': {'id': 'F1', 'name': 'Folder', 'hidden': False, 'access': True},
+            'url': f'https://app.clickup.com/t/{task_id}',
+            'custom_fields': [
+                {'id': BILLABLE_ID, 'name': 'BillableHours', 'type': 'number', 'value': str(rng.randint(0, 40))},
+                {'id': INVOICED_ID, 'name': 'InvoicedHours', 'type': 'number'},
+                {'id': 'toggl-id', 'name': 'Toggl Task Name', 'type': 'short_text', 'value': f'Toggl {i % 50}'},
+            ],
+        })
+        # ClickUp leaves `value` out of fields that were never set
+        if rng.random() < 0.7:
+            tasks[-1]['custom_fields'][1]['value'] = str(rng.randint(0, 20))
+    return tasks
+
+
+def make_time_entries(count: int, tasks: List[dict], start: int = 1_700_000_000_000, seed: int = 2) -> List[dict]:
+    """Time entry payloads shaped like /team/{id}/time_entries, spread over a month."""
+    rng = random.Random(seed)
+    users = make_users()
+    entries = []
+    for i in range(count):
+        task = tasks[rng.randrange(len(tasks))]
+        duration = rng.randint(5 * 60 * 1000, 4 * HOUR)
+        entry_start = start + rng.randrange(30 * 24 * HOUR)
+        entries.append({
+            'id': str(10_000_000 + i),
+            'task': {'id': task['id'], 'custom_id': task['custom_id'], 'name': task['name']},
+            'user': users[rng.randrange(len(users))],
+            'duration': str(duration),
+            'start': str(entry_start),
+            'end': str(entry_start + duration),
+            'billable': True,
+        })
+    return entries
+
+
+def measure(func: Callable, repeat: int = 3) -> Tuple[float, int]:
+    """Best wall time in seconds over `repeat` runs and the peak traced allocation (bytes) of one run."""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def report(name: str, seconds: float, peak: int):
+    print(f"{name:<40} {seconds * 1000:10.1f} ms {peak / 1024 / 1024:10.1f} MiB peak")
@@ -0,0 +1,54 @@
+"""Compare json_normalize-then-drop with the projecting task parser on a large synthetic list.
+
+    python -m benchmarks.task_projection [tasks]
+"""
+import sys
+
+import pandas as pd
+
+from benchmarks.synthetic import make_tasks, measure, report
+from custom_fields import extract_custom_field_value
+from timetracking_report import project_tasks
+
+
+def normalize_tasks(tasks) -> pd.DataFrame:
+    """The previous fetch_and_process_tasks parsing, kept as the baseline."""
+    tasks_data = pd.json_normalize(tasks)
+    columns_to_drop = [
+        'text_content', 'description', 'orderindex', 'status.status', 'status.color', 'status.type',
+        'status.orderindex', 'creator.id', 'creator.username', 'creator.color',
+        'creator.email', 'creator.profilePicture', 'sharing.public',
+        'sharing.public_share_expires_on', 'sharing.public_fields',
+        'sharing.token', 'sharing.seo_optimized', 'permission_level',
+        'list.id', 'list.name', 'list.access', 'project.id', 'project.name',
+        'project.hidden', 'project.access', 'folder.id', 'folder.name',
+        'folder.hidden', 'folder.access', 'space.id', 'priority.color',
+        'priority.id', 'priority.orderindex', 'priority.priority', 'checklists',
+        'watchers', 'url', 'team_id'
+    ]
+    tasks_data = tasks_data.drop(columns=columns_to_drop, errors='ignore')
+    tasks_data['InvoicedHours'] = tasks_data['custom_fields'].apply(
+        lambda x: extract_custom_field_value(x, 'InvoicedHours'))
+    tasks_data['BillableHours'] = tasks_data['custom_fields'].apply(
+        lambda x: extract_custom_field_value(x, 'BillableHours'))
+    tasks_data['InvoicedHours'] = pd.to_numeric(tasks_data['InvoicedHours'], errors='coerce').fillna(0)
+    return tasks_data
+
+
+def main(count: int = 50_000):
+    tasks = make_tasks(count)
+    pages = [tasks[i:i + 100] for i in range(0, len(tasks), 100)]
+
+    common = ['id', 'parent', 'name', 'custom_id', 'InvoicedHours']
+    pd.testing.assert_frame_equal(normalize_tasks(tasks)[common], project_tasks(pages)[common])
+
+    print(f"{count} tasks")
+    normalized = measure(lambda: normalize_tasks(tasks), repeat=1)
+    projected = measure(lambda: project_tasks(pages))
+    report('json_normalize + drop', *normalized)
+    report('project_tasks', *projected)
+    print(f"speedup: {normalized[0] / projected[0]:.1f}x, peak memory: {normalized[1] / projected[1]:.1f}x lower")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
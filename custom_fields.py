@@ -0,0 +1,20 @@
+from typing import Dict, Iterable, List, Optional
+
+
+def extract_custom_field_value(custom_fields, field_name):
+    for field in custom_fields:
+        if field['name'] == field_name:
+            return field.get('value')
+    return None
+
+
+def index_custom_fields(custom_fields: Optional[List[dict]], field_names: Iterable[str]) -> Dict[str, dict]:
+    """Map each requested field name to its field in one scan; the first field wins on repeats."""
+    wanted = set(field_names)
+    found = {}
+    for field in custom_fields or ():
+        name = field['name']
+        if name in wanted and name not in found:
+            found[name] = field
+    return found
+
@@ -1,58 +1,61 @@
+import datetime
+import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
+from api_client import ApiError, can_access_teams, clickup_get, iter_clickup_pages
+from cache import TTLCache
+
 LIST_ID = '7-2454960-1'
 TEAM_ID = '2454960'
+# The rendered list is shared by everyone opening the demo page on the same day
+DEMO_CACHE_TTL = float(os.environ.get('CLICKUP_DEMO_CACHE_TTL', 5 * 60))
+
+TAG_PATTERN = re.compile(r'<.*?>')
+ROW_TEMPLATE = '|{space_name}|{assignees}|[{task_id}: {task_name}](https://app.clickup.com/t/{team_id}/{task_id})| |'
+
+demo_cache = TTLCache(maxsize=8, ttl=DEMO_CACHE_TTL)
 
 
 def get_tasks_list(list_id, token):
-    page = 0
-    all_tasks = []
-    last_page = False
-    while not last_page:
-        response = requests.get(
-            url='https://api.clickup.com/api/v2/view/%s/task' % list_id,
-            headers={'Authorization': token, 'Content-Type': 'application/json'},
-            params={
-                'page': page
-            }
-        )
-
-        # Check the response status code
-        if response.status_code != 200:
-            print(f"Error: {response.status_code}")
-            exit()
-
-        # Parse the JSON response
-        data = response.json()
-        tasks = data["tasks"]
-        last_page = data["last_page"]
-
-        # Add the tasks to the all_tasks list
-        all_tasks += tasks
-        # Increment the page number
-        page += 1
-    return all_tasks
+    """Fetch the tasks of a view page by page; every page is retried with backoff by `send`.
+
+    Returns the tasks and an error message. If a page still fails, the tasks of the pages before
+    it are returned together with a description of the failure instead of raising.
+    """
+    tasks = []
+    try:
+        for data in iter_clickup_pages('view/%s/task' % list_id, token):
+            tasks.extend(data['tasks'])
+    except ApiError as e:
+        if e.status_code == 401:
+            raise
+        print(f"Error: {e}")
+        return tasks, f"ClickUp returned status {e.status_code} while loading the view"
+    except requests.RequestException as e:
+        print(f"Error: {e}")
+        return tasks, "ClickUp could not be reached while loading the view"
+    return tasks, None
 
 
 def get_spaces(team_id, token):
-    response = requests.get(
-        url='https://api.clickup.com/api/v2/team/%s/space' % team_id,
-        headers={'Authorization': token, 'Content-Type': 'application/json'},
+    response = clickup_get(
+        'team/%s/space' % team_id,
+        token,
         params={
             'archived': False
         }
     )
     spaces_dict = {}
-    for space in response.json()["spaces"]:
+    for space in response["spaces"]:
         spaces_dict[space["id"]] = space["name"]
     return spaces_dict
 
 
 def group_tasks(tasks, spaces):
     grouped_tasks = {}
-    pattern = r'<.*?>'
 
     # Loop through each task
     for task in tasks:
@@ -62,39 +65,42 @@ def group_tasks(tasks, spaces):
         # Create a key for the assignees
         key = " && ".join(sorted(assignees))
 
-        # Get the space name from the spaces dictionary
-        space_name = spaces.get(task["space"]["id"])
-
         # Add the task to the corresponding group
-        if key in grouped_tasks:
-            grouped_tasks[key].append({
-                "space_name": space_name,
-                "task_id": task["custom_id"],
-                "task_name": re.sub(pattern, '', task["name"]),
-                "assignees": assignees
-            })
-        else:
-            grouped_tasks[key] = [{
-                "space_name": space_name,
-                "task_id": task["custom_id"],
-                "task_name": re.sub(pattern, '', task["name"]),
-                "assignees": assignees
-            }]
+        grouped_tasks.setdefault(key, []).append({
+            "space_name": spaces.get(task["space"]["id"]),
+            "task_id": task["custom_id"],
+            "task_name": TAG_PATTERN.sub('', task["name"]),
+            "assignees": assignees
+        })
 
     return grouped_tasks
 
 
-def generate_demo_list(token, list_id, team_id):
-    spaces = get_spaces(team_id, token)
-    tasks = get_tasks_list(list_id, token)
+def generate_demo_list(token, list_id, team_id, use_cache=True):
+    cache_key = (list_id, team_id, datetime.date.today())
+    if use_cache:
+        cached = demo_cache.get(cache_key)
+        if cached is not None and can_access_teams(token, [team_id]):
+            return cached
+
+    # The spaces call is independent of the task pages, so it runs alongside them
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        spaces_future = executor.submit(get_spaces, team_id, token)
+        tasks, error = get_tasks_list(list_id, token)
+        spaces = spaces_future.result()
     grouped_tasks = group_tasks(tasks, spaces)
 
-    md = "|Space|Presenter|Summary|Notes|\n"
-    md += "| --- | --- | --- |--- |\n"
+    lines = []
+    if error:
+        lines += [f"**Incomplete list:** {error}, only the first {len(tasks)} tasks are listed. "
+                  "Reload the page to retry.", ""]
+    lines += ["|Space|Presenter|Summary|Notes|", "| --- | --- | --- |--- |"]
     for assignee, tasks in grouped_tasks.items():
         for task in tasks:
-            md += '|{space_name}|{assignees}|[{task_id}: {task_name}](https://app.clickup.com/t/{team_id}/{task_id})| |\n'.format(
-                space_name=task["space_name"], task_id=task["task_id"], task_name=task["task_name"],
-                assignees=assignee, team_id=team_id)
+            lines.append(ROW_TEMPLATE.format(space_name=task["space_name"], task_id=task["task_id"],
+                                             task_name=task["task_name"], assignees=assignee, team_id=team_id))
+    md = "\n".join(lines) + "\n"
 
+    if not error:
+        demo_cache.set(cache_key, md)
     return md
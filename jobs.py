@@ -0,0 +1,83 @@
+import os
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from cache import TTLCache
+
+# Long-running reports and syncs run here instead of in gunicorn's request threads
+JOB_WORKERS = int(os.environ.get('CLICKUP_JOB_WORKERS', 2))
+# Finished jobs (and their results) are kept this long for the status page to pick them up
+JOB_RESULT_TTL = float(os.environ.get('CLICKUP_JOB_RESULT_TTL', 60 * 60))
+MAX_JOBS = 100
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    # Hash of the submitter's token, only they may read the job
+    owner: str
+    # Keyword arguments the job was started with, available to the result page
+    params: dict = field(default_factory=dict)
+    status: str = 'queued'
+    progress: str = ''
+    result: Any = None
+    error: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+
+    def set_progress(self, message: str):
+        print(f"job {self.id} ({self.kind}): {message}")
+        self.progress = message
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'error': self.error,
+            'elapsed': (self.finished or time.time()) - self.created,
+        }
+
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='job')
+_jobs = TTLCache(maxsize=MAX_JOBS, ttl=JOB_RESULT_TTL)
+
+
+def _run(job: Job, func: Callable, args, kwargs):
+    job.status = 'running'
+    try:
+        job.result = func(*args, progress=job.set_progress, **kwargs)
+        job.status = 'done'
+    except Exception as e:
+        traceback.print_exc()
+        job.error = str(e)
+        job.status = 'failed'
+    finally:
+        job.finished = time.time()
+        # Start the result retention window now that the job is over
+        _jobs.set(job.id, job)
+
+
+def submit_job(kind: str, owner: str, func: Callable, *args, **kwargs) -> Job:
+    """Run `func(*args, progress=..., **kwargs)` on the job pool and return the job to poll.
+
+    Jobs live in the memory of the worker that accepted them; the deployment runs a single
+    gunicorn worker, so every status request sees them.
+    """
+    job = Job(id=uuid.uuid4().hex, kind=kind, owner=owner, params=kwargs)
+    _jobs.set(job.id, job, ttl=None)
+    _executor.submit(_run, job, func, args, kwargs)
+    return job
+
+
+def get_job(job_id: str, owner: str) -> Optional[Job]:
+    job = _jobs.get(job_id)
+    if job is None or job.owner != owner:
+        return None
+    return job
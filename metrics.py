@@ -0,0 +1,113 @@
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple, Union
+from urllib.parse import urlsplit
+
+# Upper bounds, in seconds, of the latency histogram buckets (upstream calls and report stages)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Path segments holding ids (anything with a digit, except API versions) are collapsed in endpoint labels
+_ID_SEGMENT = re.compile(r'^(?!v\d+$).*\d')
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> Iterator[Tuple[str, int]]:
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield ('+Inf' if bound == float('inf') else repr(float(bound))), total
+
+
+_lock = threading.Lock()
+_upstream_requests: Dict[Tuple[str, str, str, str], int] = {}
+_upstream_latency: Dict[Tuple[str, str, str], Histogram] = {}
+_stage_latency: Dict[str, Histogram] = {}
+_stage_failures: Dict[str, int] = {}
+
+
+def endpoint_label(url: str) -> Tuple[str, str]:
+    """Split a request URL into (host, path template), e.g. /api/v2/list/{id}/task."""
+    parts = urlsplit(url)
+    path = '/'.join('{id}' if _ID_SEGMENT.match(segment) else segment for segment in parts.path.split('/'))
+    return parts.netloc, path
+
+
+def observe_request(method: str, url: str, status: Union[int, str], seconds: float):
+    """Count one upstream HTTP attempt; `status` is the response code or 'error' when none came back."""
+    host, endpoint = endpoint_label(url)
+    with _lock:
+        key = (host, method, endpoint, str(status))
+        _upstream_requests[key] = _upstream_requests.get(key, 0) + 1
+        _upstream_latency.setdefault((host, method, endpoint), Histogram()).observe(seconds)
+
+
+@contextmanager
+def span(stage: str):
+    """Time a report stage, e.g. `with span('timetrack.merge'):`; usable as a decorator too."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        with _lock:
+            _stage_failures[stage] = _stage_failures.get(stage, 0) + 1
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        with _lock:
+            _stage_latency.setdefault(stage, Histogram()).observe(elapsed)
+
+
+def _labels(**labels: str) -> str:
+    def escape(value: str) -> str:
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _render_histogram(lines: List[str], name: str, labels: dict, histogram: Histogram):
+    for bound, count in histogram.cumulative():
+        lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {count}')
+    lines.append(f'{name}_sum{_labels(**labels)} {histogram.sum}')
+    lines.append(f'{name}_count{_labels(**labels)} {histogram.count}')
+
+
+def render_metrics() -> str:
+    """Everything collected by this worker, in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        lines.append('# HELP clickup_upstream_requests_total Upstream HTTP attempts (retries included).')
+        lines.append('# TYPE clickup_upstream_requests_total counter')
+        for (host, method, endpoint, status), count in sorted(_upstream_requests.items()):
+            lines.append(f'clickup_upstream_requests_total'
+                         f'{_labels(host=host, method=method, endpoint=endpoint, status=status)} {count}')
+
+        lines.append('# HELP clickup_upstream_request_duration_seconds Upstream HTTP attempt latency.')
+        lines.append('# TYPE clickup_upstream_request_duration_seconds histogram')
+        for (host, method, endpoint), histogram in sorted(_upstream_latency.items()):
+            _render_histogram(lines, 'clickup_upstream_request_duration_seconds',
+                              dict(host=host, method=method, endpoint=endpoint), histogram)
+
+        lines.append('# HELP clickup_stage_duration_seconds Duration of report, sync and write-back stages.')
+        lines.append('# TYPE clickup_stage_duration_seconds histogram')
+        for stage, histogram in sorted(_stage_latency.items()):
+            _render_histogram(lines, 'clickup_stage_duration_seconds', dict(stage=stage), histogram)
+
+        lines.append('# HELP clickup_stage_failures_total Stages that ended with an exception.')
+        lines.append('# TYPE clickup_stage_failures_total counter')
+        for stage, count in sorted(_stage_failures.items()):
+            lines.append(f'clickup_stage_failures_total{_labels(stage=stage)} {count}')
+
+    return '\n'.join(lines) + '\n'
@@ -1,66 +1,113 @@
-import requests
+from typing import Iterator, List, Optional
+
+from api_client import FieldUpdate, iter_clickup_pages, update_custom_field_values
+from metrics import span
+from task_store import STORE_PATH, iter_list_tasks, needs_full_sync, sync_list_tasks
+from timetracking_report import invalidate_report_cache
 
 BILLABLE_ID = '074e1387-e7b8-41c6-92db-fbada8f8486c'
 INVOICED_ID = '82aa8afc-dbd2-4a80-b4ae-cccd06ba774b'
 REPORTED_BY = 'eb30f61c-dbad-4ad4-896d-15d2a239cb69'
 
 
-def generate_report(list_id, token, refresh_invoiced=False):
-    r = requests.get(
-        url='https://api.clickup.com/api/v2/list/%s/task' % list_id,
+def is_billable(task):
+    for f in task['custom_fields']:
+        if f['id'] == BILLABLE_ID and f.get('value') not in (None, ''):
+            return float(f['value']) > 0
+    return False
+
+
+def iter_billable_tasks(token, list_id) -> Iterator[List[dict]]:
+    """Yield batches of top-level tasks with BillableHours > 0.
+
+    Batches come from the local store after an incremental sync. When the store is disabled, or
+    the list is due for a full reload, billable tasks are read page by page from ClickUp instead,
+    so rows are produced before the last page arrives; the reload is left to the next full reader.
+    """
+    if STORE_PATH and not needs_full_sync(list_id):
+        sync_list_tasks(token, list_id)
+        for batch in iter_list_tasks(list_id):
+            yield [task for task in batch if not task.get('parent') and is_billable(task)]
+        return
+
+    pages = iter_clickup_pages(
+        'list/%s/task' % list_id,
+        token,
         params={
             'include_closed': True,
             'archived': False,
             'custom_fields': '[{"field_id": "%s", "operator": ">", "value": 0}]' % BILLABLE_ID,
         },
-        headers={'Authorization': token, 'Content-Type': 'application/json'}
     )
+    for page in pages:
+        yield page['tasks']
+
+
+def build_reported_task(task) -> Optional[dict]:
+    custom_fields = {}
+    for f in task['custom_fields']:
+        if 'value' in f:
+            custom_fields[f['id']] = f['value']
+        else:
+            custom_fields[f['id']] = 0
+
+    reported_task = {
+        'custom_id': task['custom_id'],
+        'name': task['name'],
+        'priority': task['priority']['priority'] if task['priority'] else '-',
+        'tags': ", ".join([t['name'] for t in task['tags']]),
+        'reporter': custom_fields[REPORTED_BY] if REPORTED_BY in custom_fields else '-',
+        'billable': float(custom_fields[BILLABLE_ID] if BILLABLE_ID in custom_fields else 0),
+        'invoiced': float(custom_fields[INVOICED_ID] if INVOICED_ID in custom_fields else 0),
+    }
+    reported_task['monthly_reported'] = reported_task['billable'] - reported_task['invoiced']
+
+    # skip 0 invoced tasks
+    if reported_task['monthly_reported'] == 0:
+        return None
+    return reported_task
 
-    reported_tasks = []
+
+def iter_report_rows(list_id, token, refresh_invoiced=False, dry_run=False) -> Iterator[dict]:
+    """Yield report rows batch by batch, followed by the totals row."""
     totals = {
         'billable': 0.0,
         'invoiced': 0.0,
         'monthly_reported': 0.0,
     }
-    for task in r.json()['tasks']:
-        custom_fields = {}
-        for f in task['custom_fields']:
-            if 'value' in f:
-                custom_fields[f['id']] = f['value']
-            else:
-                custom_fields[f['id']] = 0
-
-        reported_task = {
-            'custom_id': task['custom_id'],
-            'name': task['name'],
-            'priority': task['priority']['priority'] if task['priority'] else '-',
-            'tags': ", ".join([t['name'] for t in task['tags']]),
-            'reporter': custom_fields[REPORTED_BY] if REPORTED_BY in custom_fields else '-',
-            'billable': float(custom_fields[BILLABLE_ID] if BILLABLE_ID in custom_fields else 0),
-            'invoiced': float(custom_fields[INVOICED_ID] if INVOICED_ID in custom_fields else 0),
-        }
-        reported_task['monthly_reported'] = reported_task['billable'] - reported_task['invoiced']
-
-        # skip 0 invoced tasks
-        if reported_task['monthly_reported'] == 0:
-            continue
-
-        reported_tasks.append(reported_task)
+    for batch in iter_billable_tasks(token, list_id):
+        reported_tasks = []
+        invoiced_updates = []
+        for task in batch:
+            reported_task = build_reported_task(task)
+            if reported_task is None:
+                continue
+            reported_tasks.append(reported_task)
+
+            if refresh_invoiced:
+                # set invoiced equal billable
+                invoiced_updates.append(FieldUpdate(task_id=task['id'], field_id=INVOICED_ID,
+                                                    value=reported_task['billable'], label=task['custom_id']))
 
         if refresh_invoiced:
-            # set invoiced equal billable
-            u = requests.post(
-                url='https://api.clickup.com/api/v2/task/%s/field/%s' % (task['id'], INVOICED_ID),
-                headers={'Authorization': token, 'Content-Type': 'application/json'},
-                json={'value': reported_task['billable']}
-            )
-            print('Task %s updated. R: %s' % (task['custom_id'], u.status_code))
-
-        for key in totals:
-            totals[key] += reported_task[key]
-
-    reported_tasks.append(totals)
-    return reported_tasks
+            with span('billable.write_back'):
+                results = update_custom_field_values(token, invoiced_updates, dry_run=dry_run)
+            if invoiced_updates and not dry_run:
+                # Time tracking reports show InvoicedHours
+                invalidate_report_cache()
+            for reported_task, result in zip(reported_tasks, results):
+                reported_task['invoiced_update'] = result['status'] + (': ' + result['error'] if result['error'] else '')
+
+        for reported_task in reported_tasks:
+            for key in totals:
+                totals[key] += reported_task[key]
+            yield reported_task
+
+    yield totals
+
+
+def generate_report(list_id, token, refresh_invoiced=False, dry_run=False):
+    return list(iter_report_rows(list_id, token, refresh_invoiced=refresh_invoiced, dry_run=dry_run))
 
 #
 # parser = argparse.ArgumentParser(description='ClickUp report builder')
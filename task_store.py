@@ -0,0 +1,164 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterator, List
+
+from api_client import fetch_all_tasks, iter_clickup_pages
+
+# Local SQLite copy of every task of a list; set CLICKUP_STORE_PATH to an empty value to disable it
+STORE_PATH = os.environ.get('CLICKUP_STORE_PATH', '/tmp/clickup-store.sqlite3')
+# Deleted, archived or moved tasks never show up in an incremental sync, so the list is reloaded periodically
+FULL_SYNC_INTERVAL = float(os.environ.get('CLICKUP_STORE_FULL_SYNC_HOURS', 24)) * 60 * 60 * 1000
+# Re-read a small window before the last sync to tolerate clock skew between us and ClickUp
+UPDATE_OVERLAP = 5 * 60 * 1000
+
+# Parameters of the list task listing kept in the store: everything but archived tasks, subtasks included
+TASK_PARAMS = {"archived": "false", "subtasks": "true", "include_closed": "true"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    list_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    parent TEXT,
+    date_created INTEGER,
+    date_updated INTEGER,
+    data TEXT NOT NULL,
+    sync_id INTEGER,
+    PRIMARY KEY (list_id, id)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    list_id TEXT PRIMARY KEY,
+    last_sync INTEGER NOT NULL,
+    last_full_sync INTEGER NOT NULL
+);
+"""
+
+_list_locks = {}
+_list_locks_guard = threading.Lock()
+
+
+def _list_lock(list_id: str) -> threading.Lock:
+    with _list_locks_guard:
+        return _list_locks.setdefault(list_id, threading.Lock())
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(STORE_PATH, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(tasks)')}
+    if 'sync_id' not in columns:
+        conn.execute('ALTER TABLE tasks ADD COLUMN sync_id INTEGER')
+    return conn
+
+
+def _to_int(value):
+    return int(value) if value not in (None, '') else None
+
+
+def _is_full_sync_due(state, now: int) -> bool:
+    return state is None or now - state[1] >= FULL_SYNC_INTERVAL
+
+
+def needs_full_sync(list_id: str) -> bool:
+    """Whether the next sync of a list reloads it completely (never synced, or FULL_SYNC_INTERVAL passed)."""
+    conn = _connect()
+    try:
+        state = conn.execute('SELECT last_sync, last_full_sync FROM sync_state WHERE list_id = ?',
+                             (list_id,)).fetchone()
+    finally:
+        conn.close()
+    return _is_full_sync_due(state, int(time.time() * 1000))
+
+
+def sync_list_tasks(token: str, list_id: str) -> int:
+    """Bring the stored copy of a list up to date and return how many tasks were fetched.
+
+    The first call (and one every FULL_SYNC_INTERVAL) reloads the whole list; in between only
+    tasks updated since the previous sync are requested through `date_updated_gt`.
+
+    Every page is committed in its own short transaction, so memory stays bounded by a page and
+    the database write lock is never held across a request (other lists sync meanwhile). Rows
+    carry the start time of the sync that wrote them; a full sync ends by dropping the rows it did
+    not see, so until then readers get the previous copy updated with the pages fetched so far.
+    """
+    with _list_lock(list_id):
+        conn = _connect()
+        try:
+            state = conn.execute('SELECT last_sync, last_full_sync FROM sync_state WHERE list_id = ?',
+                                 (list_id,)).fetchone()
+            started = int(time.time() * 1000)
+            full = _is_full_sync_due(state, started)
+
+            params = dict(TASK_PARAMS)
+            if not full:
+                params['date_updated_gt'] = state[0] - UPDATE_OVERLAP
+
+            fetched = 0
+            for page in iter_clickup_pages(f"list/{list_id}/task", token, params=params):
+                with conn:
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO tasks (list_id, id, parent, date_created, date_updated, data, '
+                        'sync_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        [(list_id, task['id'], task.get('parent'), _to_int(task.get('date_created')),
+                          _to_int(task.get('date_updated')), json.dumps(task), started) for task in page['tasks']]
+                    )
+                fetched += len(page['tasks'])
+
+            with conn:
+                if full:
+                    # Deleted, archived or moved tasks are the ones this reload did not write
+                    conn.execute('DELETE FROM tasks WHERE list_id = ? AND (sync_id IS NULL OR sync_id < ?)',
+                                 (list_id, started))
+                conn.execute(
+                    'INSERT OR REPLACE INTO sync_state (list_id, last_sync, last_full_sync) VALUES (?, ?, ?)',
+                    (list_id, started, started if full else state[1])
+                )
+        finally:
+            conn.close()
+
+    print(f"synced list {list_id}: {fetched} tasks ({'full' if full else 'incremental'})")
+    return fetched
+
+
+def iter_list_tasks(list_id: str, batch_size: int = 100) -> Iterator[List[dict]]:
+    """Yield the stored tasks of a list in batches, without loading the whole list in memory."""
+    conn = _connect()
+    try:
+        cursor = conn.execute('SELECT data FROM tasks WHERE list_id = ? ORDER BY date_created DESC, id',
+                              (list_id,))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [json.loads(data) for data, in rows]
+    finally:
+        conn.close()
+
+
+def load_list_tasks(list_id: str) -> List[dict]:
+    return [task for batch in iter_list_tasks(list_id, batch_size=1000) for task in batch]
+
+
+def iter_list_task_batches(token: str, list_id: str) -> Iterator[List[dict]]:
+    """Like get_list_tasks, but yields the tasks in batches (store rows or ClickUp pages) as they are read."""
+    if not STORE_PATH:
+        for page in iter_clickup_pages(f"list/{list_id}/task", token, params=TASK_PARAMS):
+            yield page['tasks']
+        return
+    sync_list_tasks(token, list_id)
+    yield from iter_list_tasks(list_id)
+
+
+def get_list_tasks(token: str, list_id: str) -> List[dict]:
+    """Return every non-archived task of a list (subtasks and closed tasks included).
+
+    Reads from the local store after an incremental sync, or straight from ClickUp when the
+    store is disabled.
+    """
+    if not STORE_PATH:
+        return fetch_all_tasks(f"list/{list_id}/task", token, params=TASK_PARAMS)
+    sync_list_tasks(token, list_id)
+    return load_list_tasks(list_id)
@@ -1,12 +1,37 @@
-from pprint import pprint
-from typing import List, Dict
-
+import dataclasses
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, List, Dict, Tuple
+
+import numpy as np
 import pandas as pd
 import ast
-import requests
 import datetime
 
+from api_client import FieldUpdate, can_access_teams, update_custom_field_values
+from async_client import fetch_time_entries, run_async
+from cache import TTLCache
 from client import Client, clients
+from custom_fields import index_custom_fields
+from metrics import span
+from task_store import iter_list_task_batches
+
+# How many clients are fetched at the same time in parallel mode
+CLIENT_CONCURRENCY = int(os.environ.get('CLICKUP_CLIENT_CONCURRENCY', 4))
+# Computed reports of the current month are reused for this many seconds; closed months never expire
+REPORT_CACHE_TTL = float(os.environ.get('CLICKUP_REPORT_CACHE_TTL', 10 * 60))
+REPORT_CACHE_SIZE = int(os.environ.get('CLICKUP_REPORT_CACHE_SIZE', 12))
+
+report_cache = TTLCache(maxsize=REPORT_CACHE_SIZE, ttl=REPORT_CACHE_TTL)
+# Bumped by every invalidation; a report whose run overlapped one is not stored, it may predate the write-back
+_report_cache_generation = 0
+_report_cache_lock = threading.Lock()
+
+# Task fields kept by fetch_and_process_tasks
+TASK_COLUMNS = ['id', 'parent', 'name', 'custom_id', 'assignees', 'InvoicedHours', 'BillableHours',
+                'BillableHoursFieldId']
 
 developer_coefficients = {
     'Yauheni Batsianouski': 1,
@@ -19,82 +44,67 @@ developer_coefficients = {
 }
 
 
-def extract_custom_field_value(custom_fields, field_name):
-    for field in custom_fields:
-        if field['name'] == field_name:
-            return field.get('value')
-    return None
-
-
-def extract_custom_field_id(custom_fields, field_name):
-    for field in custom_fields:
-        if field['name'] == field_name:
-            return field.get('id')
-    return None
+def project_tasks(batches: Iterable[List[dict]]) -> pd.DataFrame:
+    """Build the tasks frame from raw task payloads, keeping only the fields the report uses.
+
+    Custom fields are resolved while the batches are read, so the nested payload is never
+    flattened into a wide frame.
+    """
+    columns = {name: [] for name in TASK_COLUMNS}
+    for batch in batches:
+        for task in batch:
+            fields = index_custom_fields(task.get('custom_fields'), ['InvoicedHours', 'BillableHours'])
+            invoiced = fields.get('InvoicedHours', {})
+            billable = fields.get('BillableHours', {})
+            columns['id'].append(task['id'])
+            columns['parent'].append(task.get('parent'))
+            columns['name'].append(task.get('name'))
+            columns['custom_id'].append(task.get('custom_id'))
+            columns['assignees'].append(task.get('assignees') or [])
+            columns['InvoicedHours'].append(invoiced.get('value'))
+            columns['BillableHours'].append(billable.get('value'))
+            columns['BillableHoursFieldId'].append(billable.get('id'))
+
+    tasks_data = pd.DataFrame(columns, columns=TASK_COLUMNS)
+    tasks_data['InvoicedHours'] = pd.to_numeric(tasks_data['InvoicedHours'], errors='coerce').fillna(0)
+    tasks_data['BillableHours'] = pd.to_numeric(tasks_data['BillableHours'], errors='coerce')
+    return tasks_data
 
 
 def fetch_and_process_tasks(token: str, client: Client) -> pd.DataFrame:
     # Loading full tasks list
-    tasks_data = []
-    url = f"https://api.clickup.com/api/v2/list/{client.list_id}/task"
-    last_page = False
-    page = 0
-
-    while not last_page:
-        print(f"fetching tasks for {client.name}, page: {page}")
-        response = requests.get(
-            url,
-            headers={'Authorization': token, 'Content-Type': 'application/json'},
-            params={
-                "archived": "false", "page": page, "subtasks": "true", "include_closed": "true",
-            }
-        )
-        page += 1
-        # TODO add status check
-        tasks_data.extend(response.json()['tasks'])
-        last_page = response.json()['last_page']
-
-    tasks_data = pd.json_normalize(tasks_data)
-
-    # List of columns to drop if they exist
-    columns_to_drop = [
-        'text_content', 'description', 'orderindex', 'status.status', 'status.color', 'status.type',
-        'status.orderindex', 'creator.id', 'creator.username', 'creator.color',
-        'creator.email', 'creator.profilePicture', 'sharing.public',
-        'sharing.public_share_expires_on', 'sharing.public_fields',
-        'sharing.token', 'sharing.seo_optimized', 'permission_level',
-        'list.id', 'list.name', 'list.access', 'project.id', 'project.name',
-        'project.hidden', 'project.access', 'folder.id', 'folder.name',
-        'folder.hidden', 'folder.access', 'space.id', 'priority.color',
-        'priority.id', 'priority.orderindex', 'priority.priority', 'checklists',
-        'watchers', 'url', 'team_id'
-    ]
-
-    # Drop columns if they exist, ignore if they don't
-    tasks_data = tasks_data.drop(columns=columns_to_drop, errors='ignore')
-
-    pprint(tasks_data.axes)
-
-    tasks_data['InvoicedHours'] = tasks_data['custom_fields'].apply(
-        lambda x: extract_custom_field_value(x, 'InvoicedHours'))
-    tasks_data['BillableHours'] = tasks_data['custom_fields'].apply(
-        lambda x: extract_custom_field_value(x, 'BillableHours'))
-    tasks_data['InvoicedHours'] = pd.to_numeric(tasks_data['InvoicedHours'], errors='coerce').fillna(0)
-
-    # tasks_data = tasks_data.drop(columns=['custom_fields'])
-    tasks_data['client'] = client.name
+    print(f"fetching tasks for {client.name}")
+    with span('timetrack.fetch_tasks'):
+        tasks_data = project_tasks(iter_list_task_batches(token, client.list_id))
+    tasks_data['client'] = constant_category(client.name, len(tasks_data))
 
     return tasks_data
 
 
+def add_durations(time_report_data: pd.DataFrame) -> pd.DataFrame:
+    """Add TotalDuration and AdjustedDuration (hours) computed from the `duration` column in milliseconds."""
+    time_report_data['TotalDuration'] = time_report_data['duration'] / 60 / 60 / 1000
+    # Default coefficient is 1 if username not found
+    coefficients = time_report_data['user.username'].map(developer_coefficients).fillna(1)
+    time_report_data['AdjustedDuration'] = time_report_data['TotalDuration'] / coefficients
+    return time_report_data
+
+
+def project_time_entries(time_entries: List[dict]) -> pd.DataFrame:
+    """Build the time entries frame from raw payloads, keeping only the fields the report uses.
+
+    Usernames and task ids repeat across entries and are held as categories.
+    """
+    return pd.DataFrame({
+        'user.username': pd.Categorical([(entry.get('user') or {}).get('username') for entry in time_entries]),
+        'duration': pd.to_numeric(pd.Series([entry.get('duration') for entry in time_entries], dtype=object),
+                                  errors='coerce'),
+        'task.id': pd.Categorical([(entry.get('task') or {}).get('id') for entry in time_entries]),
+    })
+
+
 def fetch_and_process_time_report(token: str, selected_date: datetime.datetime, tasks_data: pd.DataFrame,
                                   client: Client) -> pd.DataFrame:
-    def calculate_adjusted_duration(row):
-        if row['user.username'] in developer_coefficients:
-            return row['duration'] / 60 / 60 / 1000 / developer_coefficients[row['user.username']]
-        else:
-            return row['duration'] / 60 / 60 / 1000 / 1  # Default coefficient is 1 if username not found
-
     all_assignees = [assignee for sublist in tasks_data['assignees'].tolist() for assignee in sublist]
     assignees_df = pd.DataFrame(all_assignees)
     unique_assignees_df = assignees_df.drop_duplicates()
@@ -109,97 +119,219 @@ def fetch_and_process_time_report(token: str, selected_date: datetime.datetime,
         last_day_of_month = selected_date.replace(month=selected_date.month + 1, day=1) - datetime.timedelta(days=1)
     last_day_of_month = last_day_of_month.replace(hour=23, minute=59, second=59, microsecond=999999)
 
-    url = f"https://api.clickup.com/api/v2/team/{client.team_id}/time_entries"
-    response = requests.get(url, headers={'Authorization': token, 'Content-Type': 'application/json'},
-                            params={
-                                "start_date": int(first_day_of_month.timestamp() * 1000),
-                                "end_date": int(last_day_of_month.timestamp() * 1000),
-                                "assignee": ','.join([str(x) for x in id_list]),
-                                "include_task_tags": "true",
-                                "list_id": client.list_id,
-                            })
-    time_report = response.json()
-    if len(time_report['data']) == 0:
+    # Fetched as concurrent week x assignee-batch slices, merged and de-duplicated by entry id
+    with span('timetrack.fetch_time_entries'):
+        time_entries = run_async(fetch_time_entries, token, client.team_id,
+                                 int(first_day_of_month.timestamp() * 1000), int(last_day_of_month.timestamp() * 1000),
+                                 params={
+                                     "include_task_tags": "true",
+                                     "list_id": client.list_id,
+                                 },
+                                 assignees=id_list)
+    if len(time_entries) == 0:
         return pd.DataFrame()
 
-    time_report_data = (pd.json_normalize(time_report['data'])[['user.username', 'duration', 'task.id', 'task.custom_id', 'task.name']])
-    time_report_data['duration'] = pd.to_numeric(time_report_data['duration'], errors='coerce')
-    time_report_data['TotalDuration'] = time_report_data.apply(lambda row: row['duration'] / 60 / 60 / 1000, axis=1)
-    time_report_data['AdjustedDuration'] = time_report_data.apply(calculate_adjusted_duration, axis=1)
-    time_report_data['client'] = client.name
+    with span('timetrack.normalize'):
+        time_report_data = add_durations(project_time_entries(time_entries))
+    time_report_data['client'] = constant_category(client.name, len(time_report_data))
 
     return time_report_data
 
 
+def constant_category(value: str, length: int) -> pd.Categorical:
+    """A column holding `value` on every row, stored as one category and int8 codes."""
+    return pd.Categorical.from_codes(np.zeros(length, dtype='int8'), categories=[value])
+
+
+def concat_compact(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate the per-client frames once, keeping categorical columns categorical.
+
+    pd.concat falls back to object columns when categories differ, so they are unioned first,
+    in sorted order so that groupby and sort_values keep ordering values alphabetically.
+    The given frames are recoded in place.
+    """
+    # Clients without time entries come back as frames without columns
+    frames = [frame for frame in frames if len(frame.columns)] or frames
+    for column in frames[0].columns:
+        dtypes = [frame[column].dtype for frame in frames if column in frame]
+        if all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+            categories = set()
+            for dtype in dtypes:
+                categories.update(dtype.categories)
+            dtype = pd.CategoricalDtype(sorted(categories))
+            for frame in frames:
+                if column in frame:
+                    frame[column] = frame[column].cat.set_categories(dtype.categories)
+    return pd.concat(frames)
+
+
 def calculate_personal_timereport(time_report_data: pd.DataFrame) -> pd.DataFrame:
-    final_report = time_report_data.groupby(['user.username', 'client'])[
+    final_report = time_report_data.groupby(['user.username', 'client'], observed=True)[
         ['AdjustedDuration', 'TotalDuration']].sum().reset_index()
     return final_report.sort_values(['client', 'AdjustedDuration'], ascending=[True, False])
 
 
 def generate_final_report(tasks_data: pd.DataFrame, time_report_data: pd.DataFrame) -> pd.DataFrame:
-    merged_df = pd.merge(tasks_data, time_report_data, left_on=['id', 'client'], right_on=['task.id', 'client'],
-                         how='left')
-    merged_df['parent'].fillna(merged_df['id'], inplace=True)
-
-    grouped_df = merged_df.groupby(['parent', 'id', 'client'])['AdjustedDuration'].sum().reset_index()
-
-    final_report = pd.merge(grouped_df, tasks_data[['id', 'client']], left_on=['parent', 'client'],
-                            right_on=['id', 'client'])
-    final_report = final_report.rename(columns={'id_y': 'id'})
-    final_report = final_report.drop(columns=['parent', 'id_x'])
-    final_report = final_report[final_report['AdjustedDuration'] != 0]
-    final_report['AdjustedDuration'] = (round(final_report['AdjustedDuration'] * 2) / 2)
-    final_report = final_report.groupby(['id', 'client'])['AdjustedDuration'].sum().reset_index()
-
-    final_report = pd.merge(final_report, tasks_data[['id', 'name', 'custom_id', 'InvoicedHours', 'client']],
-                            left_on=['id', 'client'], right_on=['id', 'client'])
+    """Roll tracked time up to parent tasks, one row per task with time.
+
+    Every task's AdjustedDuration is summed and rounded to half hours, then added to its parent
+    (or to itself when it has none). Tasks whose parent is not in the list are left out. The
+    work happens on positions into tasks_data; name/custom_id/InvoicedHours are joined once at
+    the end. Sorted by client, then AdjustedDuration descending.
+    """
+    # A task seen twice (e.g. shifted between pages while listing) is counted once
+    tasks_data = tasks_data.drop_duplicates(['id', 'client'])
+    task_keys = pd.MultiIndex.from_arrays([tasks_data['client'], tasks_data['id']])
+
+    # Position of each entry's task and of each task's parent in tasks_data, -1 when not in the list
+    entry_positions = task_keys.get_indexer(
+        pd.MultiIndex.from_arrays([time_report_data['client'], time_report_data['task.id']]))
+    parents = tasks_data['parent'].where(tasks_data['parent'].notna(), tasks_data['id'])
+    parent_positions = task_keys.get_indexer(pd.MultiIndex.from_arrays([tasks_data['client'], parents]))
+
+    # Per-task totals; pandas' grouped sum keeps the floats identical to the former merge/groupby chain
+    known = entry_positions >= 0
+    task_hours = pd.Series(time_report_data['AdjustedDuration'].to_numpy()[known]).groupby(
+        entry_positions[known]).sum()
+    task_hours = task_hours[task_hours != 0]
+
+    owners = parent_positions[task_hours.index.to_numpy()]
+    rolled_up = owners >= 0
+    owners = owners[rolled_up]
+    hours = np.bincount(owners, weights=np.round(task_hours.to_numpy()[rolled_up] * 2) / 2,
+                        minlength=len(tasks_data))
+    reported = np.unique(owners)
+
+    final_report = pd.DataFrame({
+        'id': tasks_data['id'].to_numpy()[reported],
+        'client': tasks_data['client'].to_numpy()[reported],
+        'AdjustedDuration': hours[reported],
+        'name': tasks_data['name'].to_numpy()[reported],
+        'custom_id': tasks_data['custom_id'].to_numpy()[reported],
+        'InvoicedHours': tasks_data['InvoicedHours'].to_numpy()[reported],
+    })
+    final_report = final_report.sort_values(['id', 'client']).reset_index(drop=True)
     final_report = final_report.sort_values(['client', 'AdjustedDuration'], ascending=[True, False])
 
     return final_report
 
 
 # Define function to update custom fields
-def update_custom_fields(token: str, final_report: pd.DataFrame, clients: List[Client], tasks_data: pd.DataFrame):
-    print("Updating tasks")
-    for index, row in final_report.iterrows():
-        client = next((c for c in clients if c.name == row['client']), None)
-        if client:
-            task_data = tasks_data[tasks_data['id'] == row['id']].iloc[0]
-            billable_id = extract_custom_field_id(task_data['custom_fields'], 'BillableHours')
+def update_custom_fields(token: str, final_report: pd.DataFrame, clients: List[Client], tasks_data: pd.DataFrame,
+                         dry_run: bool = False) -> pd.DataFrame:
+    print("Updating tasks" if not dry_run else "Dry run: collecting task updates")
+    updates = []
+    skipped = []
+    client_names = {c.name for c in clients}
+    # id -> BillableHours field id, parsed once in fetch_and_process_tasks
+    billable_ids = dict(zip(tasks_data['id'], tasks_data['BillableHoursFieldId']))
+    for row in final_report[['id', 'client', 'custom_id', 'InvoicedHours', 'AdjustedDuration']].itertuples(index=False):
+        if row.client in client_names:
+            billable_id = billable_ids.get(row.id)
             if billable_id:
-                print(
-                    f"updating {row['custom_id']} to {row['InvoicedHours'] + row['AdjustedDuration']} for client {client.name}")
-                url = f"https://api.clickup.com/api/v2/task/{row['id']}/field/{billable_id}"
-                response = requests.post(url, headers={'Authorization': token, 'Content-Type': 'application/json'},
-                                         json={"value": str(row['InvoicedHours'] + row['AdjustedDuration'])})
-                print(response.json())
+                updates.append(FieldUpdate(task_id=row.id, field_id=billable_id,
+                                           value=str(row.InvoicedHours + row.AdjustedDuration),
+                                           label=row.custom_id))
             else:
-                print(f"BillableHours field not found for task {row['custom_id']}")
+                skipped.append({'task_id': row.id, 'task': row.custom_id, 'status': 'skipped',
+                                'error': 'BillableHours field not found'})
         else:
-            print(f"Client not found for task {row['custom_id']}")
-
-
-def generate_timetracking_report(token: str, selected_date: datetime.datetime, refresh_billable: bool = False) -> Dict[
-    str, pd.DataFrame]:
-    all_tasks_data = pd.DataFrame()
-    all_time_report_data = pd.DataFrame()
-
-    for client in clients:
-        tasks_data = fetch_and_process_tasks(token, client)
-        time_report_data = fetch_and_process_time_report(token, selected_date, tasks_data, client)
-
-        all_tasks_data = pd.concat([all_tasks_data, tasks_data])
-        all_time_report_data = pd.concat([all_time_report_data, time_report_data])
-
-    personal_timereport = calculate_personal_timereport(all_time_report_data)
-    final_report = generate_final_report(all_tasks_data, all_time_report_data)
-
-    if refresh_billable:
-        update_custom_fields(token, final_report, clients, all_tasks_data)
-
-    return {
+            skipped.append({'task_id': row.id, 'task': row.custom_id, 'status': 'skipped',
+                            'error': 'Client not found'})
+
+    results = update_custom_field_values(token, updates, dry_run=dry_run)
+    summary = pd.DataFrame(results + skipped, columns=['task_id', 'task', 'field_id', 'value', 'status', 'error'])
+    print(summary['status'].value_counts().to_dict())
+    return summary
+
+
+def fetch_client_data(token: str, selected_date: datetime.datetime,
+                      client: Client) -> Tuple[pd.DataFrame, pd.DataFrame, float]:
+    started = time.perf_counter()
+    tasks_data = fetch_and_process_tasks(token, client)
+    time_report_data = fetch_and_process_time_report(token, selected_date, tasks_data, client)
+    # Assignees were only needed to query the time entries
+    del tasks_data['assignees']
+    elapsed = time.perf_counter() - started
+    print(f"fetched {client.name} in {elapsed:.2f}s")
+    return tasks_data, time_report_data, elapsed
+
+
+def report_cache_key(selected_date: datetime.datetime, clients: List[Client]) -> tuple:
+    return selected_date.strftime('%Y-%m'), tuple(dataclasses.astuple(client) for client in clients)
+
+
+def invalidate_report_cache():
+    """Drop every memoized report, e.g. after Billable/Invoiced hours were written back to ClickUp."""
+    global _report_cache_generation
+    with _report_cache_lock:
+        _report_cache_generation += 1
+        report_cache.clear()
+
+
+def is_closed_month(selected_date: datetime.datetime) -> bool:
+    return (selected_date.year, selected_date.month) < (datetime.datetime.now().year, datetime.datetime.now().month)
+
+
+def generate_timetracking_report(token: str, selected_date: datetime.datetime, refresh_billable: bool = False,
+                                 parallel: bool = True, dry_run: bool = False, use_cache: bool = True,
+                                 progress: Callable[[str], None] = print) -> Dict[str, pd.DataFrame]:
+    cache_key = report_cache_key(selected_date, clients)
+    cache_generation = _report_cache_generation
+    if use_cache and not refresh_billable:
+        cached = report_cache.get(cache_key)
+        # Cached reports are shared; a token outside the clients' workspaces computes (and fails) upstream
+        if cached is not None and can_access_teams(token, {client.team_id for client in clients}):
+            progress(f"report for {cache_key[0]} served from cache")
+            return dict(cached)
+
+    progress(f"fetching {len(clients)} clients")
+    with span('timetrack.fetch_clients'):
+        if parallel:
+            with ThreadPoolExecutor(max_workers=max(1, CLIENT_CONCURRENCY)) as executor:
+                futures = {executor.submit(fetch_client_data, token, selected_date, client): client for client in clients}
+                for done, future in enumerate(as_completed(futures), start=1):
+                    progress(f"fetched {futures[future].name} ({done}/{len(clients)} clients)")
+                results = [future.result() for future in futures]
+        else:
+            results = []
+            for done, client in enumerate(clients, start=1):
+                results.append(fetch_client_data(token, selected_date, client))
+                progress(f"fetched {client.name} ({done}/{len(clients)} clients)")
+
+    all_tasks_data = concat_compact([tasks_data for tasks_data, _, _ in results])
+    all_time_report_data = concat_compact([time_report_data for _, time_report_data, _ in results])
+    client_timings = pd.DataFrame({
+        'client': [client.name for client in clients],
+        'FetchSeconds': [elapsed for _, _, elapsed in results],
+    }).sort_values('FetchSeconds', ascending=False)
+
+    progress("building report")
+    with span('timetrack.merge'):
+        final_report = generate_final_report(all_tasks_data, all_time_report_data)
+    with span('timetrack.group'):
+        personal_timereport = calculate_personal_timereport(all_time_report_data)
+        total = final_report.groupby('client', observed=True)['AdjustedDuration'].sum().reset_index()
+
+    report_data = {
         'final_report': final_report,
         'personal_timereport': personal_timereport,
-        'total': final_report.groupby('client')['AdjustedDuration'].sum().reset_index()
+        'total': total,
+        'client_timings': client_timings,
+        'update_summary': None,
     }
+
+    if refresh_billable:
+        progress(f"updating billable hours of {len(final_report)} tasks")
+        with span('timetrack.write_back'):
+            report_data['update_summary'] = update_custom_fields(token, final_report, clients, all_tasks_data,
+                                                                 dry_run=dry_run)
+        if not dry_run:
+            invalidate_report_cache()
+    else:
+        with _report_cache_lock:
+            if cache_generation == _report_cache_generation:
+                report_cache.set(cache_key, report_data,
+                                 ttl=None if is_closed_month(selected_date) else REPORT_CACHE_TTL)
+
+    return dict(report_data)
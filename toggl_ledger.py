@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+# Local record of the ClickUp time entries already pushed to Toggl; set CLICKUP_TOGGL_LEDGER_PATH to an
+# empty value to disable it (every sync then creates every entry again)
+LEDGER_PATH = os.environ.get('CLICKUP_TOGGL_LEDGER_PATH', '/tmp/toggl-ledger.sqlite3')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS toggl_entries (
+    workspace_id TEXT NOT NULL,
+    clickup_id TEXT NOT NULL,
+    client TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    toggl_id INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    task_id TEXT,
+    task_name TEXT,
+    toggl_task_name TEXT,
+    synced_at INTEGER NOT NULL,
+    clickup_user_id TEXT,
+    PRIMARY KEY (workspace_id, clickup_id)
+);
+"""
+
+_workspace_locks = {}
+_workspace_locks_guard = threading.Lock()
+
+
+@dataclass
+class LedgerEntry:
+    clickup_id: str
+    # None until the entry is first created in Toggl
+    toggl_id: Optional[int]
+    hash: str
+    # ClickUp start of the entry in milliseconds, before any overlap shifting
+    start: int
+    task_id: Optional[str] = None
+    task_name: Optional[str] = None
+    toggl_task_name: Optional[str] = None
+    # ClickUp user whose sync pushed the entry; None for rows written before it was recorded
+    clickup_user_id: Optional[str] = None
+
+
+def workspace_lock(workspace_id: str) -> threading.Lock:
+    """Serializes syncs into one workspace, so two runs never create the same entry twice."""
+    with _workspace_locks_guard:
+        return _workspace_locks.setdefault(workspace_id, threading.Lock())
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(LEDGER_PATH, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(toggl_entries)')}
+    if 'clickup_user_id' not in columns:
+        conn.execute('ALTER TABLE toggl_entries ADD COLUMN clickup_user_id TEXT')
+    return conn
+
+
+def entry_hash(payload: dict) -> str:
+    """Content hash of a Toggl time entry payload; a changed hash means the Toggl entry needs an update."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_entries(workspace_id: str, client: str, clickup_user_id: str) -> Dict[str, LedgerEntry]:
+    """Return the ledger of one user's entries of a client in a workspace, keyed by ClickUp time entry id.
+
+    Several people sync into the same workspace, each seeing only their own ClickUp entries, so a
+    sync must never see (and delete) rows pushed by someone else. Rows from before the user was
+    recorded are included; the caller does not treat them as deletion candidates.
+    """
+    if not LEDGER_PATH:
+        return {}
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            'SELECT clickup_id, toggl_id, hash, start, task_id, task_name, toggl_task_name, clickup_user_id '
+            'FROM toggl_entries WHERE workspace_id = ? AND client = ? '
+            'AND (clickup_user_id = ? OR clickup_user_id IS NULL)',
+            (workspace_id, client, clickup_user_id)
+        ).fetchall()
+    finally:
+        conn.close()
+    return {row[0]: LedgerEntry(*row) for row in rows}
+
+
+def record_entries(workspace_id: str, client: str, entries: List[LedgerEntry]):
+    if not LEDGER_PATH or not entries:
+        return
+    synced_at = int(time.time() * 1000)
+    conn = _connect()
+    try:
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO toggl_entries (workspace_id, clickup_id, client, start, toggl_id, hash, '
+                'task_id, task_name, toggl_task_name, synced_at, clickup_user_id) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(workspace_id, entry.clickup_id, client, entry.start, entry.toggl_id, entry.hash, entry.task_id,
+                  entry.task_name, entry.toggl_task_name, synced_at, entry.clickup_user_id) for entry in entries]
+            )
+    finally:
+        conn.close()
+
+
+def forget_entries(workspace_id: str, clickup_ids: List[str]):
+    if not LEDGER_PATH or not clickup_ids:
+        return
+    conn = _connect()
+    try:
+        with conn:
+            conn.executemany('DELETE FROM toggl_entries WHERE workspace_id = ? AND clickup_id = ?',
+                             [(workspace_id, clickup_id) for clickup_id in clickup_ids])
+    finally:
+        conn.close()
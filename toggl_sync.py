@@ -1,64 +1,97 @@
 import base64
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
-from typing import List
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 import pandas as pd
+from api_client import PAGE_CONCURRENCY, ApiError, clickup_get, send, token_key
+from async_client import AsyncApi, fetch_tasks_details, fetch_time_entries, run_async
+from cache import TTLCache
 from client import Client, clients
+from custom_fields import extract_custom_field_value
+from metrics import span
+from task_store import get_list_tasks
+from toggl_ledger import LedgerEntry, entry_hash, forget_entries, load_entries, record_entries, workspace_lock
 from datetime import datetime
 
-
-def extract_custom_field_value(custom_fields, field_name):
-    for field in custom_fields:
-        if field['name'] == field_name:
-            return field.get('value')
-    return None
-
-
-def fetch_task_details(token: str, task_id: str) -> dict:
-    url = f"https://api.clickup.com/api/v2/task/{task_id}"
-    response = requests.get(
-        url,
-        headers={'Authorization': token, 'Content-Type': 'application/json'}
-    )
-    return response.json()
-
-
-def fetch_clickup_time_entries(token: str, client: Client, start_date: int, end_date: int) -> pd.DataFrame:
-    url = f"https://api.clickup.com/api/v2/team/{client.team_id}/time_entries"
-    response = requests.get(
-        url,
-        headers={'Authorization': token, 'Content-Type': 'application/json'},
+TOGGL_API_URL = os.environ.get('CLICKUP_TOGGL_API_URL', 'https://api.track.toggl.com/api/v9')
+TOGGL_TASK_NAME_FIELD = 'Toggl Task Name'
+# Workspace task lists are reused across syncs for this many seconds
+TOGGL_TASK_CACHE_TTL = float(os.environ.get('CLICKUP_TOGGL_TASK_CACHE_TTL', 10 * 60))
+# A cached task list that lacks a name an entry asks for is reloaded early, but at most once per this many seconds
+TOGGL_TASK_REFRESH_INTERVAL = float(os.environ.get('CLICKUP_TOGGL_TASK_REFRESH_INTERVAL', 60))
+
+# Toggl creates/updates/deletes in flight at the same time during a sync
+TOGGL_PUSH_CONCURRENCY = int(os.environ.get('CLICKUP_TOGGL_PUSH_CONCURRENCY', 4))
+
+toggl_task_cache = TTLCache(maxsize=32, ttl=TOGGL_TASK_CACHE_TTL)
+
+
+def resolve_toggl_task_names(token: str, client: Client, task_ids: Iterable[str],
+                             cache: Dict[str, Optional[str]]) -> Dict[str, Optional[str]]:
+    """Map ClickUp task ids to their "Toggl Task Name" custom field value.
+
+    Tasks missing from `cache` are resolved in bulk from the client's stored list (custom fields
+    come with the listing); whatever is still unknown, e.g. archived tasks, is looked up concurrently.
+    The cache is filled in place so it can be shared across clients of one sync run.
+    """
+    task_ids = set(task_ids)
+    if task_ids - cache.keys():
+        for task in get_list_tasks(token, client.list_id):
+            cache[task['id']] = extract_custom_field_value(task['custom_fields'], TOGGL_TASK_NAME_FIELD)
+
+    missing = list(task_ids - cache.keys())
+    if missing:
+        for task_id, task in run_async(fetch_tasks_details, token, missing).items():
+            cache[task_id] = extract_custom_field_value(task['custom_fields'], TOGGL_TASK_NAME_FIELD)
+
+    return {task_id: cache[task_id] for task_id in task_ids}
+
+
+def fetch_clickup_time_entries(token: str, client: Client, start_date: int, end_date: int,
+                               task_name_cache: Optional[Dict[str, Optional[str]]] = None) -> pd.DataFrame:
+    columns = ['id', 'task.id', 'task.name', 'user.username', 'duration', 'start', 'end', 'toggl_task_name']
+    time_entries = run_async(
+        fetch_time_entries,
+        token,
+        client.team_id,
+        start_date,
+        end_date,
         params={
-            "start_date": start_date,
-            "end_date": end_date,
             "include_task_tags": "true",
             "list_id": client.list_id,
         }
     )
-    time_entries = response.json()['data']
+    if not time_entries:
+        return pd.DataFrame(columns=columns)
 
     df = pd.json_normalize(time_entries)
 
-    # Fetch task details for each unique task
-    unique_tasks = df['task.id'].unique()
-    task_details = {}
-    for task_id in unique_tasks:
-        task_details[task_id] = fetch_task_details(token, task_id)
+    # Resolve the Toggl task name of every unique task in one go
+    if task_name_cache is None:
+        task_name_cache = {}
+    toggl_task_names = resolve_toggl_task_names(token, client, df['task.id'].unique(), task_name_cache)
 
     # Add Toggl task name to the dataframe
-    df['toggl_task_name'] = df['task.id'].apply(
-        lambda x: extract_custom_field_value(task_details[x]['custom_fields'], 'Toggl Task Name'))
+    df['toggl_task_name'] = df['task.id'].map(toggl_task_names)
 
-    return df[['id', 'task.id', 'task.name', 'user.username', 'duration', 'start', 'end', 'toggl_task_name']]
+    return df[columns]
 
 
-def fetch_toggl_tasks(toggl_api_token: str, workspace_id: str, page: int = 1, per_page: int = 1000,
-                      sort_order: str = 'ASC', sort_field: str = 'name',
-                      active: bool = True) -> List[dict]:
-    url = f"https://api.track.toggl.com/api/v9/workspaces/{workspace_id}/tasks"
-    headers = {
+def toggl_headers(toggl_api_token: str) -> dict:
+    return {
+        "Content-Type": "application/json",
         "Authorization": f"Basic {base64.b64encode(f'{toggl_api_token}:api_token'.encode()).decode()}"
     }
+
+
+def fetch_toggl_tasks(toggl_api_token: str, workspace_id: str, page: int = 1, per_page: int = 1000,
+                      sort_order: str = 'ASC', sort_field: str = 'name',
+                      active: bool = True) -> dict:
+    """Fetch one page of workspace tasks; the response carries `data` and, usually, `total_count`."""
+    url = f"{TOGGL_API_URL}/workspaces/{workspace_id}/tasks"
     params = {
         'page': page,
         'per_page': per_page,
@@ -68,132 +101,295 @@ def fetch_toggl_tasks(toggl_api_token: str, workspace_id: str, page: int = 1, pe
     if active is not None:
         params['active'] = 'both' if active == 'both' else str(active).lower()
 
-    response = requests.get(url, headers=headers, params=params)
-    response.raise_for_status()  # Raise an exception for bad status codes
-    return response.json()['data']
+    response = send('GET', url, headers=toggl_headers(toggl_api_token), params=params)
+    return response.json()
 
 
-def find_toggl_task(toggl_tasks: List[dict], task_name: str) -> dict:
-    for task in toggl_tasks:
-        if task['name'] == task_name:
-            return task
-    return None
+def fetch_all_toggl_tasks(toggl_api_token: str, workspace_id: str, per_page: int = 1000) -> List[dict]:
+    first = fetch_toggl_tasks(toggl_api_token, workspace_id, page=1, per_page=per_page)
+    tasks = list(first['data'])
+    total_count = first.get('total_count')
+    if total_count is not None:
+        # Page count is known up front: fetch the rest concurrently
+        pages = range(2, math.ceil(total_count / per_page) + 1)
+        with ThreadPoolExecutor(max_workers=max(1, PAGE_CONCURRENCY)) as executor:
+            for response in executor.map(
+                    lambda page: fetch_toggl_tasks(toggl_api_token, workspace_id, page=page, per_page=per_page), pages):
+                tasks.extend(response['data'])
+        return tasks
+
+    page, data = 1, first['data']
+    while len(data) == per_page:
+        page += 1
+        data = fetch_toggl_tasks(toggl_api_token, workspace_id, page=page, per_page=per_page)['data']
+        tasks.extend(data)
+    return tasks
+
+
+def get_toggl_task_index(toggl_api_token: str, workspace_id: str,
+                         required_names: Iterable[str] = ()) -> Dict[str, dict]:
+    """Return a name -> Toggl task dict of the workspace, cached for TOGGL_TASK_CACHE_TTL seconds.
+
+    A cached index that lacks any of `required_names` is refreshed, so tasks created in Toggl
+    since the last fetch are picked up. Names that do not exist in Toggl would otherwise reload it
+    on every sync, so an index is refreshed early at most once per TOGGL_TASK_REFRESH_INTERVAL.
+    On duplicate names the first task (by name order) wins.
+    """
+    key = (workspace_id, token_key(toggl_api_token))
+    cached = toggl_task_cache.get(key)
+    if cached is not None:
+        index, fetched_at = cached
+        missing = {name for name in required_names if name} - index.keys()
+        if not missing or time.monotonic() - fetched_at < TOGGL_TASK_REFRESH_INTERVAL:
+            return index
+
+    index = {}
+    for task in fetch_all_toggl_tasks(toggl_api_token, workspace_id):
+        index.setdefault(task['name'], task)
+    toggl_task_cache.set(key, (index, time.monotonic()))
+    return index
 
 
 def shift_overlaps(time_entries: pd.DataFrame) -> pd.DataFrame:
-    time_entries = time_entries.sort_values('start')
-    shifted_entries = []
-
-    for i, entry in time_entries.iterrows():
-        if not shifted_entries or entry['start'] >= shifted_entries[-1]['end']:
-            shifted_entries.append(entry)
-        else:
+    """Shift entries that overlap an earlier entry of the same task to start when that one ends.
+
+    All tasks are handled in one linear scan over the entries sorted by (task, start); the
+    result is ordered the same way. start/end/duration come back as integer milliseconds.
+    Entries without a task are dropped, as grouping by task used to do.
+    """
+    time_entries = time_entries[time_entries['task.id'].notna()].copy()
+    for column in ('start', 'end', 'duration'):
+        time_entries[column] = pd.to_numeric(time_entries[column]).astype('int64')
+    time_entries = time_entries.sort_values(['task.id', 'start'], kind='stable')
+
+    task_ids = time_entries['task.id'].tolist()
+    starts = time_entries['start'].tolist()
+    ends = time_entries['end'].tolist()
+    durations = time_entries['duration'].tolist()
+
+    previous_task = None
+    previous_end = 0
+    for i, task_id in enumerate(task_ids):
+        if task_id == previous_task and starts[i] < previous_end:
             # Shift the start time of the current entry
-            new_start = shifted_entries[-1]['end']
-            duration = entry['duration']
-            new_end = new_start + duration
+            starts[i] = previous_end
+            ends[i] = previous_end + durations[i]
+        previous_task = task_id
+        previous_end = ends[i]
+
+    time_entries['start'] = starts
+    time_entries['end'] = ends
+    return time_entries
+
+
+def build_toggl_entry(entry: pd.Series, toggl_task: dict, workspace_id: str) -> dict:
+    # Convert milliseconds to seconds
+    duration = int(entry['duration']) / 1000
+    start_time = datetime.fromtimestamp(int(entry['start']) / 1000)
+
+    # Create ClickUp task link
+    clickup_task_link = f"https://app.clickup.com/t/{entry['task.id']}"
+
+    return {
+        "description": f"{entry['task.name']} - {clickup_task_link}",
+        "workspace_id": int(workspace_id),
+        "project_id": toggl_task['project_id'],
+        "task_id": toggl_task['id'],
+        "duration": int(duration),
+        "start": start_time.isoformat() + "Z",
+        "created_with": "ClickUp Sync",
+        "billable": False  # You can change this if needed
+    }
 
-            shifted_entry = entry.copy()
-            shifted_entry['start'] = new_start
-            shifted_entry['end'] = new_end
-            shifted_entries.append(shifted_entry)
 
-    return pd.DataFrame(shifted_entries)
+async def push_toggl_entry(api: AsyncApi, workspace_id: str, headers: dict, data: dict,
+                           toggl_id: Optional[int] = None) -> Tuple[int, str]:
+    """Create the Toggl entry, or update `toggl_id` in place; returns the Toggl id and a result status."""
+    url = f"{TOGGL_API_URL}/workspaces/{workspace_id}/time_entries"
+    if toggl_id is not None:
+        try:
+            await api.send('PUT', f"{url}/{toggl_id}", json=data, headers=headers)
+            return toggl_id, 'Updated'
+        except ApiError as e:
+            if e.status_code != 404:
+                raise
+            # Deleted in Toggl since the last sync, create it again
+
+    response = await api.send('POST', url, json=data, headers=headers)
+    return response.json()['id'], 'Synced successfully'
+
+
+async def delete_toggl_entry(api: AsyncApi, workspace_id: str, headers: dict, toggl_id: int):
+    try:
+        await api.send('DELETE', f"{TOGGL_API_URL}/workspaces/{workspace_id}/time_entries/{toggl_id}", headers=headers)
+    except ApiError as e:
+        # Already gone in Toggl is as good as deleted
+        if e.status_code != 404:
+            raise
+
+
+async def push_toggl_changes(api: AsyncApi, workspace_id: str, headers: dict,
+                             pushes: List[Tuple[dict, Optional[int]]], deletions: List[int]) -> List:
+    """Send all creates/updates and deletes at once; outcomes (or exceptions) come back in input order."""
+    return await api.gather(
+        [push_toggl_entry(api, workspace_id, headers, data, toggl_id) for data, toggl_id in pushes] +
+        [delete_toggl_entry(api, workspace_id, headers, toggl_id) for toggl_id in deletions],
+        return_exceptions=True
+    )
+
 
+def sync_to_toggl(clickup_entries: pd.DataFrame, toggl_api_token: str, workspace_id: str, client_name: str,
+                  clickup_user_id: str, start_date: Optional[int] = None, end_date: Optional[int] = None):
+    """Push one ClickUp user's entries to Toggl, creating new ones and updating changed ones.
 
-def sync_to_toggl(clickup_entries: pd.DataFrame, toggl_api_token: str, workspace_id: str, client_name: str):
-    toggl_tasks = fetch_toggl_tasks(toggl_api_token, workspace_id)
+    Entries already in the ledger with the same content are skipped. With a date range, ledger
+    entries of `clickup_user_id` starting in it that ClickUp no longer returns are deleted from
+    Toggl. Payloads are prepared first and sent concurrently, TOGGL_PUSH_CONCURRENCY at a time.
+    """
+    toggl_tasks = get_toggl_task_index(toggl_api_token, workspace_id,
+                                       required_names=clickup_entries['toggl_task_name'].dropna())
+    headers = toggl_headers(toggl_api_token)
     error_entries = []
     synced_entries = []
 
-    for _, entry in clickup_entries.iterrows():
-        if pd.isna(entry['toggl_task_name']) or entry['toggl_task_name'] == '':
-            error_entries.append({
-                'Client': client_name,
-                'ClickUp Task': entry['task.name'],
-                'ClickUp Link': f"https://app.clickup.com/t/{entry['task.id']}",
-                'Toggl Task Name': 'Not specified',
-                'Error': 'Toggl Task Name is not filled'
-            })
-            continue
-
-        toggl_task = find_toggl_task(toggl_tasks, entry['toggl_task_name'])
-
-        if not toggl_task:
-            error_entries.append({
-                'Client': client_name,
-                'ClickUp Task': entry['task.name'],
-                'ClickUp Link': f"https://app.clickup.com/t/{entry['task.id']}",
-                'Toggl Task Name': entry['toggl_task_name'],
-                'Error': 'No matching Toggl task found'
-            })
-            continue
-
-        # Convert milliseconds to seconds
-        duration = int(entry['duration']) / 1000
-        start_time = datetime.fromtimestamp(int(entry['start']) / 1000)
-
-        # Create time entry in Toggl
-        url = f"https://api.track.toggl.com/api/v9/workspaces/{workspace_id}/time_entries"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Basic {base64.b64encode(f'{toggl_api_token}:api_token'.encode()).decode()}"
-        }
-
-        # Create ClickUp task link
-        clickup_task_link = f"https://app.clickup.com/t/{entry['task.id']}"
-
-        data = {
-            "description": f"{entry['task.name']} - {clickup_task_link}",
-            "workspace_id": int(workspace_id),
-            "project_id": toggl_task['project_id'],
-            "task_id": toggl_task['id'],
-            "duration": int(duration),
-            "start": start_time.isoformat() + "Z",
-            "created_with": "ClickUp Sync",
-            "billable": False  # You can change this if needed
-        }
-
-        response = requests.post(url, json=data, headers=headers)
-
-        if response.status_code == 200:
-            synced_entries.append({
+    with workspace_lock(workspace_id):
+        ledger = load_entries(workspace_id, client_name, clickup_user_id)
+        seen = set()
+        pending = []
+
+        for _, entry in clickup_entries.iterrows():
+            entry_id = str(entry['id'])
+            seen.add(entry_id)
+            clickup_task_link = f"https://app.clickup.com/t/{entry['task.id']}"
+
+            if pd.isna(entry['toggl_task_name']) or entry['toggl_task_name'] == '':
+                error_entries.append({
+                    'Client': client_name,
+                    'ClickUp Task': entry['task.name'],
+                    'ClickUp Link': clickup_task_link,
+                    'Toggl Task Name': 'Not specified',
+                    'Error': 'Toggl Task Name is not filled'
+                })
+                continue
+
+            toggl_task = toggl_tasks.get(entry['toggl_task_name'])
+
+            if not toggl_task:
+                error_entries.append({
+                    'Client': client_name,
+                    'ClickUp Task': entry['task.name'],
+                    'ClickUp Link': clickup_task_link,
+                    'Toggl Task Name': entry['toggl_task_name'],
+                    'Error': 'No matching Toggl task found'
+                })
+                continue
+
+            data = build_toggl_entry(entry, toggl_task, workspace_id)
+            content_hash = entry_hash(data)
+            known = ledger.get(entry_id)
+            result = {
                 'Client': client_name,
                 'ClickUp Task': entry['task.name'],
                 'ClickUp Link': clickup_task_link,
                 'Toggl Task Name': entry['toggl_task_name'],
-                'Status': 'Synced successfully'
-            })
-        else:
-            error_entries.append({
+            }
+
+            if known is not None and known.hash == content_hash:
+                synced_entries.append({**result, 'Status': 'Already synced'})
+                continue
+
+            pending.append((result, data, LedgerEntry(
+                clickup_id=entry_id,
+                toggl_id=known.toggl_id if known is not None else None,
+                hash=content_hash,
+                start=int(entry.get('clickup_start', entry['start'])),
+                task_id=entry['task.id'],
+                task_name=entry['task.name'],
+                toggl_task_name=entry['toggl_task_name'],
+                clickup_user_id=clickup_user_id,
+            )))
+
+        removed = []
+        if start_date is not None and end_date is not None:
+            removed = [known for clickup_id, known in ledger.items()
+                       if clickup_id not in seen and known.clickup_user_id == clickup_user_id
+                       and start_date <= known.start <= end_date]
+
+        outcomes = []
+        if pending or removed:
+            outcomes = run_async(push_toggl_changes, workspace_id, headers,
+                                 [(data, ledger_entry.toggl_id) for _, data, ledger_entry in pending],
+                                 [known.toggl_id for known in removed],
+                                 concurrency=TOGGL_PUSH_CONCURRENCY)
+
+        pushed = []
+        failure = None
+        for (result, _, ledger_entry), outcome in zip(pending, outcomes):
+            if isinstance(outcome, ApiError):
+                error_entries.append({
+                    **result,
+                    'Error': f"Failed to sync. Status code: {outcome.status_code}, Response: {outcome.response.text}"
+                })
+            elif isinstance(outcome, BaseException):
+                failure = failure or outcome
+            else:
+                ledger_entry.toggl_id, status = outcome
+                pushed.append(ledger_entry)
+                synced_entries.append({**result, 'Status': status})
+
+        deleted = []
+        for known, outcome in zip(removed, outcomes[len(pending):]):
+            result = {
                 'Client': client_name,
-                'ClickUp Task': entry['task.name'],
-                'ClickUp Link': clickup_task_link,
-                'Toggl Task Name': entry['toggl_task_name'],
-                'Error': f"Failed to sync. Status code: {response.status_code}, Response: {response.text}"
-            })
+                'ClickUp Task': known.task_name,
+                'ClickUp Link': f"https://app.clickup.com/t/{known.task_id}",
+                'Toggl Task Name': known.toggl_task_name,
+            }
+            if isinstance(outcome, ApiError):
+                error_entries.append({
+                    **result,
+                    'Error': f"Failed to delete. Status code: {outcome.status_code}, Response: {outcome.response.text}"
+                })
+            elif isinstance(outcome, BaseException):
+                failure = failure or outcome
+            else:
+                deleted.append(known.clickup_id)
+                synced_entries.append({**result, 'Status': 'Deleted from Toggl'})
+
+        # Record what reached Toggl before surfacing a connection failure, so a rerun does not duplicate it
+        record_entries(workspace_id, client_name, pushed)
+        forget_entries(workspace_id, deleted)
+        if failure is not None:
+            raise failure
 
     return error_entries, synced_entries
 
 
-def sync_clickup_to_toggl(token: str, toggl_api_token: str, start_date: int, end_date: int):
+def sync_clickup_to_toggl(token: str, toggl_api_token: str, start_date: int, end_date: int,
+                          progress: Callable[[str], None] = print):
     all_error_entries = []
     all_synced_entries = []
+    task_name_cache = {}
+    # ClickUp returns only the token owner's time entries, so the ledger is scoped to that user
+    clickup_user_id = str(clickup_get('user', token)['user']['id'])
 
     for client in clients:
         if client.toggl_sync_enabled:
-            print(f"Syncing time entries for {client.name}")
-            clickup_entries = fetch_clickup_time_entries(token, client, start_date, end_date)
-
-            # Group entries by task
-            grouped_entries = clickup_entries.groupby('task.id')
-
-            shifted_entries = pd.DataFrame()
-            for _, group in grouped_entries:
-                shifted_group = shift_overlaps(group)
-                shifted_entries = pd.concat([shifted_entries, shifted_group])
-
-            error_entries, synced_entries = sync_to_toggl(shifted_entries, toggl_api_token, client.toggl_workspace_id, client.name)
+            progress(f"Syncing time entries for {client.name}")
+            with span('toggl.fetch_entries'):
+                clickup_entries = fetch_clickup_time_entries(token, client, start_date, end_date, task_name_cache)
+
+            # The ledger keys deletions on the original ClickUp start, not the shifted one
+            clickup_entries['clickup_start'] = clickup_entries['start']
+            # Shift overlapping entries of every task in one pass
+            with span('toggl.shift_overlaps'):
+                shifted_entries = shift_overlaps(clickup_entries)
+
+            progress(f"Pushing {len(shifted_entries)} time entries for {client.name}")
+            with span('toggl.push'):
+                error_entries, synced_entries = sync_to_toggl(shifted_entries, toggl_api_token,
+                                                             client.toggl_workspace_id, client.name,
+                                                             clickup_user_id, start_date, end_date)
             all_error_entries.extend(error_entries)
             all_synced_entries.extend(synced_entries)
 